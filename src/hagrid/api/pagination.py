@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class SizeVariationCursorPagination(CursorPagination):
+    """
+    Pages through the variations by id, without counting them, so polling a
+    page stays cheap no matter how many variations there are.
+    """
+
+    ordering = "id"
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
@@ -3,6 +3,20 @@ from rest_framework import serializers
 from hagrid.products.models import Product, Size, SizeScale, SizeVariation
 
 
+class SparseFieldsetMixin:
+    """
+    Only serializes the fields in the comma separated ?fields= of the request,
+    if there is one. Unknown field names are ignored.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is not None and (fields := request.query_params.get("fields")):
+            for name in set(self.fields) - set(fields.split(",")):
+                self.fields.pop(name)
+
+
 class ProductAPISerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
@@ -23,10 +37,27 @@ class SizeAPISerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class SizeVariationAPISerializer(serializers.ModelSerializer):
+class SizeVariationAPISerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     size = SizeAPISerializer()
-    product = ProductAPISerializer()
+    product = ProductAPISerializer(source="design_variation.product")
 
     class Meta:
         model = SizeVariation
-        fields = "__all__"
+        # the reservation ledger and count queue are internal bookkeeping
+        exclude = ("amount_reserved", "count_priority")
+
+
+class SizeVariationFlatAPISerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Like SizeVariationAPISerializer, but with the ids and names of the
+    size, size scale and product instead of nested objects.
+    """
+
+    size_name = serializers.CharField(source="size.name")
+    size_scale = serializers.IntegerField(source="size.scale_id")
+    product = serializers.IntegerField(source="design_variation.product_id")
+    product_name = serializers.CharField(source="design_variation.product.name")
+
+    class Meta:
+        model = SizeVariation
+        exclude = SizeVariationAPISerializer.Meta.exclude
@@ -2,6 +2,8 @@ from django.urls import include, path
 from rest_framework import routers
 
 from hagrid.api.views import (
+    AvailabilityChangesView,
+    AvailabilityView,
     ProductViewSet,
     SizeScaleViewSet,
     SizeVariationProductDetail,
@@ -17,4 +19,10 @@ urlpatterns = [
     path("v1/auth/", include("rest_framework.urls")),
     path("v1/", include(router.urls)),
     path("v1/variations/", SizeVariationProductDetail.as_view(), name="api_variations"),
+    path("v1/availability/", AvailabilityView.as_view(), name="api_availability"),
+    path(
+        "v1/availability/changes/",
+        AvailabilityChangesView.as_view(),
+        name="api_availability_changes",
+    ),
 ]
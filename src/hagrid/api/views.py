@@ -1,10 +1,23 @@
+from django.db.models import Count, Max
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import generics, viewsets
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from hagrid.api.pagination import SizeVariationCursorPagination
 from hagrid.api.serializers import (
     ProductAPISerializer,
     SizeAPISerializer,
     SizeScaleAPISerializer,
     SizeVariationAPISerializer,
+    SizeVariationFlatAPISerializer,
+)
+from hagrid.products.availability import (
+    get_availability_changes,
+    get_availability_etag,
+    get_availability_version,
 )
 from hagrid.products.models import Product, Size, SizeScale, SizeVariation
 
@@ -25,11 +38,71 @@ class SizeScaleViewSet(viewsets.ModelViewSet):
 
 
 class SizeVariationProductDetail(generics.ListAPIView):
-    serializer_class = SizeVariationAPISerializer
+    """
+    The variations, optionally of a single ?product_id=, paginated with a
+    cursor. ?flat gives ids and names instead of nested objects, ?fields=
+    limits the fields to a comma separated list.
+    """
+
+    pagination_class = SizeVariationCursorPagination
+
+    def get_serializer_class(self):
+        if "flat" in self.request.query_params:
+            return SizeVariationFlatAPISerializer
+        return SizeVariationAPISerializer
 
     def get_queryset(self):
-        queryset = SizeVariation.objects.all()
+        queryset = SizeVariation.objects.select_related("size__scale", "design_variation__product")
         product_id = self.request.query_params.get("product_id", None)
         if product_id is not None:
-            queryset = queryset.filter(product__id=product_id)
+            if not product_id.isdigit():
+                raise ValidationError({"product_id": "Must be the id of a product."})
+            queryset = queryset.filter(design_variation__product_id=product_id)
         return queryset
+
+
+def availability_etag(request):
+    # variations are created and deleted without availability events
+    variations = SizeVariation.objects.aggregate(count=Count("id"), last=Max("id"))
+    return f"{get_availability_etag()}-{variations['count']}-{variations['last']}"
+
+
+def availability_changes_etag(request):
+    # the body depends on ?since= as well, invalid ones are answered with 400
+    since = request.query_params.get("since", "")
+    return f"{get_availability_etag()}-{since if since.isdigit() else ''}"
+
+
+@method_decorator(condition(etag_func=availability_etag), name="get")
+class AvailabilityView(APIView):
+    """
+    The availability of all variations by id, with the availability version
+    to ask for the changes since. Answers 304 Not Modified while the ETag in
+    If-None-Match is current.
+    """
+
+    def get(self, request):
+        version = get_availability_version()
+        return Response({
+            "version": version,
+            "availability": dict(SizeVariation.objects.values_list("pk", "availability")),
+        })
+
+
+@method_decorator(condition(etag_func=availability_changes_etag), name="get")
+class AvailabilityChangesView(APIView):
+    """
+    The availability by id of the variations that changed since the
+    availability version ?since=, and the current version to ask with next.
+    Answers 304 Not Modified while the ETag in If-None-Match is current.
+    """
+
+    def get(self, request):
+        since = request.query_params.get("since", "")
+        if not since.isdigit():
+            raise ValidationError({"since": "Must be an availability version."})
+        version = get_availability_version()
+        return Response({
+            "version": version,
+            "availability": get_availability_changes(int(since), version),
+        })
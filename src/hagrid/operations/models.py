@@ -1,9 +1,17 @@
+import time
 from datetime import datetime
 
 import numpy
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
+# bumped whenever an OpenStatus changes, see EventTime.for_event
+EVENT_TIME_VERSION_KEY = "event-time-version"
+EVENT_TIME_CACHE_TIMEOUT = 24 * 60 * 60
+
 
 class Event(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -98,6 +106,23 @@ class EventTime:
             float(self.start_event_time_by_index[-1]) if len(self.start_event_time_by_index) else 0
         )
 
+    @classmethod
+    def for_event(cls, event):
+        """
+        Get the EventTime of an event from the cache. Cached EventTimes are
+        stored under the current OpenStatus version, so anything built before
+        an OpenStatus change is never read again. The version is only bumped
+        in the cache of the process that changed the OpenStatus, so the default
+        cache has to be shared by all processes.
+        """
+        # start from the time, so an evicted version never resurrects old EventTimes
+        version = cache.get_or_set(EVENT_TIME_VERSION_KEY, time.time_ns, None)
+        key = f"event-time-{event.pk}-{version}"
+        if (event_time := cache.get(key)) is None:
+            event_time = cls(event)
+            cache.set(key, event_time, EVENT_TIME_CACHE_TIMEOUT)
+        return event_time
+
     def datetime_to_event_time(self, dt: datetime | float) -> float:
         if isinstance(dt, datetime):
             dt = dt.timestamp()
@@ -123,3 +148,38 @@ class EventTime:
 
         # convert from numpy.float
         return float(event_time)
+
+    def timestamps_to_event_times(self, timestamps) -> numpy.ndarray:
+        """
+        Like datetime_to_event_time, but for a whole array of epoch timestamps
+        at once.
+        """
+        timestamps = numpy.asarray(timestamps, dtype=float)
+        if not len(self.status_change_timestamps):
+            return numpy.zeros_like(timestamps)
+
+        idx = numpy.searchsorted(self.status_change_timestamps, timestamps) - 1
+        before_first_opening = idx < 0
+        idx[before_first_opening] = 0
+
+        start_event_time = self.start_event_time_by_index[idx]
+        event_time = numpy.where(
+            self.open_state_by_index[idx],
+            start_event_time + (timestamps - self.status_change_timestamps[idx]),
+            start_event_time,
+        )
+        return numpy.where(before_first_opening, 0, event_time)
+
+
+def bump_event_time_version():
+    try:
+        cache.incr(EVENT_TIME_VERSION_KEY)
+    except ValueError:
+        # evicted or never stored, start over from the time
+        cache.add(EVENT_TIME_VERSION_KEY, time.time_ns(), None)
+
+
+@receiver(post_save, sender=OpenStatus, dispatch_uid="event_time_open_status_save")
+@receiver(post_delete, sender=OpenStatus, dispatch_uid="event_time_open_status_delete")
+def event_time_open_status_change(sender, **kwargs):
+    transaction.on_commit(bump_event_time_version)
@@ -1,13 +1,12 @@
-import csv
-import io
-
 from django.contrib import admin
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import redirect, reverse
 from django.urls import path
 from django.utils.html import format_html
 
+from hagrid.products.export_count_events import count_events_npz, stream_count_events_csv
 from hagrid.products.pdf_code import generate_access_code_pdf
+from hagrid.utils import iterate_in_thread
 
 from .models import *
 
@@ -77,6 +76,7 @@ class CountEventAdmin(admin.ModelAdmin):
 
     actions = (
         "export_csv",
+        "export_columns",
         "clear_name",
     )
 
@@ -85,35 +85,25 @@ class CountEventAdmin(admin.ModelAdmin):
         return redirect("admin:products_variationcountevent_changelist")
 
     def export_csv(self, request, queryset):
-        events = queryset.all()
-
         filename = "variation-count-events.csv"
 
-        with io.StringIO() as buffer:
-            writer = csv.writer(buffer)
-            writer.writerow([
-                "datetime",
-                "product",
-                "SizeScalesize",
-                "comment",
-                "count",
-            ])
-            for event in events:
-                variation = event.variation
-                writer.writerow([
-                    event.datetime.strftime("%Y-%m-%d %H:%M:%S"),
-                    str(variation.product),
-                    str(variation.size.group),
-                    str(variation.size.name),
-                    str(event.comment),
-                    str(event.count),
-                ])
-            data = buffer.getvalue()
-
-        response = HttpResponse(data, content_type="text/csv")
+        response = StreamingHttpResponse(
+            iterate_in_thread(stream_count_events_csv(queryset)), content_type="text/csv"
+        )
         response["Content-Disposition"] = f'attachment; filename="{filename}"'
         return response
 
+    def export_columns(self, request, queryset):
+        filename = "variation-count-events.npz"
+
+        data = count_events_npz(queryset)
+
+        response = HttpResponse(data, content_type="application/octet-stream")
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    export_columns.short_description = "Export columns (numpy .npz)"
+
 
 @admin.register(CountAccessCode)
 class CountAccessCodeAdmin(admin.ModelAdmin):
@@ -0,0 +1,244 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q
+from django.template.loader import render_to_string
+from django_eventstream import send_event
+
+logger = logging.getLogger(__name__)
+
+# event ids are handed out before commit, so an event can commit after one
+# with a higher id. The changes since a version also include the events of
+# this long before it, so late commits of short transactions aren't missed.
+AVAILABILITY_CHANGES_OVERLAP = timedelta(seconds=60)
+
+
+class AvailabilityTransitions:
+    """
+    Collects the availability transitions of a transaction and records and
+    broadcasts them once after the transaction has been committed.
+
+    Transitions of rolled back savepoints are collected as well, so the
+    committed availabilities are read again before recording.
+    """
+
+    def __init__(self):
+        # variation id -> (variation, state before the transaction, latest state)
+        self.transitions = {}
+        # the connection's run_on_commit this collector was last found in
+        self.hooks = None
+
+    def add(self, variation, old_state, new_state):
+        if variation.pk in self.transitions:
+            _, old_state, _ = self.transitions[variation.pk]
+        self.transitions[variation.pk] = (variation, old_state, new_state)
+
+    def is_scheduled(self, connection):
+        """
+        Whether the on_commit hook of this collector is still registered.
+        Django replaces run_on_commit when the transaction ends or a savepoint
+        is rolled back, only then it has to be searched.
+        """
+        if connection.run_on_commit is not self.hooks:
+            if not any(func is self for _, func, _ in connection.run_on_commit):
+                return False
+            self.hooks = connection.run_on_commit
+        return True
+
+    def __call__(self):
+        from hagrid.products.models import SizeVariation
+
+        connection = transaction.get_connection()
+        if getattr(connection, "availability_transitions", None) is self:
+            connection.availability_transitions = None
+        transitions, self.transitions = self.transitions, {}
+        if not transitions:
+            return
+        committed = dict(
+            SizeVariation.objects.filter(pk__in=transitions).values_list("pk", "availability")
+        )
+        self.record([
+            (variation, old_state, committed[variation.pk])
+            for variation, old_state, _ in transitions.values()
+            if variation.pk in committed
+        ])
+
+    @staticmethod
+    def record(transitions):
+        from hagrid.products.models import AvailabilityEvent
+        from hagrid.products.views.dashboard import update_dashboard_snapshot_availabilities
+
+        transitions = [
+            (variation, old_state, new_state)
+            for variation, old_state, new_state in transitions
+            if old_state != new_state
+        ]
+        if not transitions:
+            return
+
+        AvailabilityEvent.objects.bulk_create([
+            AvailabilityEvent(old_state=old_state, new_state=new_state, variation=variation)
+            for variation, old_state, new_state in transitions
+        ])
+        update_dashboard_snapshot_availabilities({
+            variation.pk: new_state for variation, _, new_state in transitions
+        })
+        broadcast_availability_changes(
+            [variation for variation, _, _ in transitions],
+            {variation.pk: new_state for variation, _, new_state in transitions},
+        )
+
+
+def track_availability_transition(variation, old_state, new_state):
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        AvailabilityTransitions.record([(variation, old_state, new_state)])
+        return
+
+    # One collector per transaction, kept on the connection until it ran. A
+    # collector whose hook was dropped by a rollback only holds rolled back
+    # transitions, so it is replaced.
+    transitions = getattr(connection, "availability_transitions", None)
+    if transitions is None or not transitions.is_scheduled(connection):
+        transitions = connection.availability_transitions = AvailabilityTransitions()
+        transaction.on_commit(transitions)
+        transitions.hooks = connection.run_on_commit
+    transitions.add(variation, old_state, new_state)
+
+
+def get_availability_version():
+    """
+    The id of the latest AvailabilityEvent. It grows with every availability
+    change, so clients can ask for the changes since a version they know.
+    """
+    from hagrid.products.models import AvailabilityEvent
+
+    return AvailabilityEvent.objects.aggregate(version=Max("id"))["version"] or 0
+
+
+def get_availability_etag():
+    """
+    The availability version and the number of events, which also changes
+    when an event commits after one with a higher id.
+    """
+    from hagrid.products.models import AvailabilityEvent
+
+    events = AvailabilityEvent.objects.aggregate(version=Max("id"), count=Count("id"))
+    return f"{events['version'] or 0}-{events['count']}"
+
+
+def get_availability_changes(since, version):
+    """
+    Variation id -> current availability of the variations that changed
+    after version since, up to and including version. Variations that changed
+    within AVAILABILITY_CHANGES_OVERLAP before version since are included
+    again, repeating a current availability is harmless.
+    """
+    from hagrid.products.models import AvailabilityEvent, SizeVariation
+
+    after = Q(pk__gt=since)
+    since_datetime = (
+        AvailabilityEvent.objects.filter(pk=since).values_list("datetime", flat=True).first()
+    )
+    if since_datetime is not None:
+        after |= Q(datetime__gte=since_datetime - AVAILABILITY_CHANGES_OVERLAP)
+    changed = AvailabilityEvent.objects.filter(after, pk__lte=version)
+    variations = SizeVariation.objects.filter(pk__in=changed.values("variation_id"))
+    return dict(variations.values_list("pk", "availability"))
+
+
+class AvailabilityDisplayPublisher:
+    """
+    Merges the availability changes for the public dashboard into one compact
+    event (variation id -> state) per flush window, so that a burst of changes
+    costs a single message per connected client.
+
+    One flusher thread per process sends the pending changes, whatever is
+    still pending when the process exits is sent from an atexit handler.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.pending = {}
+        # the process the flusher runs in, threads don't survive a fork
+        self.pid = None
+
+    def publish(self, availabilities):
+        if not settings.AVAILABILITY_DISPLAY_FLUSH_WINDOW:
+            self.send(availabilities)
+            return
+        with self.lock:
+            self.pending.update(availabilities)
+            if self.pid != os.getpid():
+                if self.pid is None:
+                    # forked processes inherit the handler
+                    atexit.register(self.flush)
+                self.pid = os.getpid()
+                threading.Thread(target=self.run, name="availability-flusher", daemon=True).start()
+        self.changed.set()
+
+    def run(self):
+        while True:
+            self.changed.wait()
+            time.sleep(settings.AVAILABILITY_DISPLAY_FLUSH_WINDOW)
+            # changes published from here on wake up the next round
+            self.changed.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Could not send availability changes")
+
+    def flush(self):
+        with self.lock:
+            availabilities, self.pending = self.pending, {}
+        if availabilities:
+            self.send(availabilities)
+
+    def send(self, availabilities):
+        send_event(
+            "availability-display",
+            "availability-changes",
+            {str(variation_id): state for variation_id, state in availabilities.items()},
+        )
+
+
+availability_display_publisher = AvailabilityDisplayPublisher()
+
+
+def broadcast_availability_changes(variations, availabilities):
+    """
+    Push the committed availabilities (variation id -> state) of the changed
+    variations, their instances may hold the state of a rolled back savepoint.
+    """
+    availability_display_publisher.publish(availabilities)
+
+    # swap all changed boxes of the operator form out-of-band with one event
+    from hagrid.products.views.config import VariationsAvailabilityForm
+
+    form = VariationsAvailabilityForm(
+        variations,
+        initial={f"variation_{pk}": state for pk, state in availabilities.items()},
+    )
+    send_event(
+        "availability-form",
+        "availability-changes",
+        data="".join(
+            render_to_string(
+                "operator/variation_availability_box.html",
+                {
+                    "field": form.field_for_rendering_by_variation(variation),
+                    "variation": variation,
+                    "oob": True,
+                },
+            )
+            for variation in variations
+        ),
+        json_encode=False,
+    )
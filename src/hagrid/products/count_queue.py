@@ -0,0 +1,184 @@
+import time
+
+import numpy
+from django.core.cache import cache
+from django.utils import timezone
+
+from hagrid.operations.models import EventTime
+from hagrid.products.models import SizeVariation
+
+# parts of the count priority grow with time, so stored priorities are
+# re-scored if they are older than this (in seconds)
+COUNT_PRIORITY_RESCORE_INTERVAL = 60
+
+# re-scored priorities closer than this to the stored one aren't written back
+COUNT_PRIORITY_TOLERANCE = 1e-3
+
+# the SizeVariation columns CountPriorities is computed from, in argument order
+COUNT_PRIORITY_COLUMNS = ("count", "amount_initial", "counted_at", "count_prio_bumped")
+
+
+class CountPriorities:
+    """
+    The count priorities of many variations at once, computed from their
+    column values with numpy. Every result matches
+    SizeVariation.get_count_priority for the same variation, so changes to
+    the scoring have to be made in both places.
+
+    Scores and infos are arrays holding NaN for variations the component does
+    not apply to; index the instance to get the dict of a single variation.
+    """
+
+    def __init__(
+        self, event_time: EventTime, count, amount_initial, counted_at, prio_bumped, now=None
+    ):
+        has_count = numpy.array([c is not None for c in count], dtype=bool)
+        count = numpy.array([numpy.nan if c is None else c for c in count], dtype=float)
+        amount_initial = numpy.array([a or 0 for a in amount_initial], dtype=float)
+        has_counted_at = numpy.array([dt is not None for dt in counted_at], dtype=bool)
+        counted_event_time = event_time.timestamps_to_event_times([
+            dt.timestamp() if dt is not None else 0 for dt in counted_at
+        ])
+        prio_bumped = numpy.array(prio_bumped, dtype=bool)
+        now = event_time.datetime_to_event_time(timezone.now() if now is None else now)
+
+        depleted = count == 0
+        invalid = ~depleted & (amount_initial == 0)
+        valid = ~depleted & ~invalid
+        missing_count = valid & ~(has_count & has_counted_at)
+
+        # pretend we counted all items at t=0 with their amount_initial
+        count = numpy.where(missing_count, amount_initial, count)
+        counted_event_time = numpy.where(missing_count, 0, counted_event_time)
+
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            # try to estimate the current count
+            total_sold = amount_initial - count
+            sale_rate = numpy.maximum(0, total_sold / numpy.maximum(1, counted_event_time))
+            estimate = amount_initial - now * sale_rate
+            estimated_count = numpy.minimum(amount_initial, numpy.maximum(0, estimate))
+            count_age = numpy.maximum(0, now - counted_event_time)
+
+            running_low_estimated = self.count_severity(estimated_count, count)
+            running_low = 0.5 * self.count_severity(count, amount_initial)
+            outdated_count = 0.5 * numpy.float_power(count_age / 3600 / 4.0, 0.5)
+            recently_counted = -1.0 * (1 - count_age / (4 * 3600))
+
+        # in the insertion order of get_count_priority, which decides the sum
+        # and the highest reason on ties
+        self.scores = {
+            name: numpy.where(applies, score, numpy.nan)
+            for name, score, applies in (
+                ("bumped", 1.0, prio_bumped),
+                ("depleted", 0.0, depleted),
+                ("invalid", 0.0, invalid),
+                ("missing_count", 0.2, missing_count),
+                ("running_low_estimated", running_low_estimated, valid),
+                ("running_low", running_low, valid),
+                ("outdated_count", outdated_count, valid),
+                ("recently_counted", recently_counted, valid & (count_age < 4 * 3600)),
+            )
+        }
+        self.info = {
+            name: numpy.where(valid, value, numpy.nan)
+            for name, value in (
+                ("estimated_count", estimated_count),
+                ("sale_rate", sale_rate * 3600),
+                ("count_age", count_age),
+            )
+        }
+
+        # sum() of floats uses Neumaier summation since Python 3.12, so do the same
+        total = numpy.zeros(len(count))
+        compensation = numpy.zeros(len(count))
+        highest_score = numpy.full(len(count), -numpy.inf)
+        self.highest_reason = numpy.empty(len(count), dtype=object)
+        for name, score in self.scores.items():
+            applies = ~numpy.isnan(score)
+            score = numpy.where(applies, score, 0)
+            new_total = total + score
+            compensation += numpy.where(
+                numpy.abs(total) >= numpy.abs(score),
+                (total - new_total) + score,
+                (score - new_total) + total,
+            )
+            total = new_total
+
+            highest = applies & (score > highest_score)
+            highest_score = numpy.where(highest, score, highest_score)
+            self.highest_reason[highest] = name
+        compensate = (compensation != 0) & numpy.isfinite(compensation)
+        self.total = numpy.where(compensate, total + compensation, total)
+
+    @classmethod
+    def for_variations(cls, event_time: EventTime, variations, now=None):
+        columns = (
+            [getattr(variation, column) for variation in variations]
+            for column in COUNT_PRIORITY_COLUMNS
+        )
+        return cls(event_time, *columns, now=now)
+
+    @staticmethod
+    def count_severity(count, amount_initial, exp=0.5):
+        # float_power calls pow() like math.pow, numpy.power may take a sqrt or
+        # SIMD shortcut that is off by one ulp
+        return numpy.maximum(0, 1 - numpy.float_power(count / amount_initial, exp))
+
+    def __len__(self):
+        return len(self.total)
+
+    def __getitem__(self, index):
+        return {
+            "scores": {
+                name: float(score[index])
+                for name, score in self.scores.items()
+                if not numpy.isnan(score[index])
+            },
+            "info": {
+                name: float(value[index])
+                for name, value in self.info.items()
+                if not numpy.isnan(value[index])
+            },
+            "total": float(self.total[index]),
+            "highest_reason": self.highest_reason[index],
+        }
+
+
+def refresh_count_priorities(event_time: EventTime):
+    """
+    Store the current count priority of all variations that were changed since
+    they were last scored, or of all variations if the stored priorities are
+    outdated. Only one caller at a time re-scores all variations, the others
+    just score the changed ones meanwhile.
+    """
+    key = f"count-priorities-scored-at-{event_time.event.pk}"
+    lock_key = f"count-priorities-rescoring-{event_time.event.pk}"
+    now = time.time()
+    scored_at = cache.get(key)
+
+    variations = SizeVariation.objects.all()
+    rescore = (
+        scored_at is None or now - scored_at >= COUNT_PRIORITY_RESCORE_INTERVAL
+    ) and cache.add(lock_key, now, COUNT_PRIORITY_RESCORE_INTERVAL)
+    if not rescore:
+        variations = variations.filter(count_priority__isnull=True)
+
+    try:
+        rows = list(variations.values_list("pk", "count_priority", *COUNT_PRIORITY_COLUMNS))
+        if rows:
+            pks, stored, *columns = zip(*rows)
+            priorities = CountPriorities(event_time, *columns, now=now)
+            SizeVariation.objects.bulk_update(
+                [
+                    SizeVariation(pk=pk, count_priority=total)
+                    for pk, old, total in zip(pks, stored, priorities.total.tolist())
+                    if old is None or abs(total - old) > COUNT_PRIORITY_TOLERANCE
+                ],
+                ["count_priority"],
+                batch_size=500,
+            )
+        if rescore:
+            cache.set(key, now, None)
+    finally:
+        if rescore:
+            cache.delete(lock_key)
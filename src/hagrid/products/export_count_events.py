@@ -0,0 +1,81 @@
+import csv
+import io
+import itertools
+
+import numpy
+
+from ..utils import Echo
+
+# header -> lookup of the value, all in one query joined over the variation chain
+COLUMNS = {
+    "datetime": "datetime",
+    "variation": "variation_id",
+    "event": "variation__design_variation__design__event__name",
+    "design": "variation__design_variation__design__name",
+    "product": "variation__design_variation__product__name",
+    "size scale": "variation__size__scale__name",
+    "size": "variation__size__name",
+    "comment": "comment",
+    "count": "count",
+}
+
+
+def count_event_values(queryset, chunk_size=2000):
+    """
+    Yield a tuple of the COLUMNS values for every count event, oldest first,
+    fetched from the database chunk_size rows at a time.
+    """
+    return (
+        queryset
+        .order_by("datetime", "pk")
+        .values_list(*COLUMNS.values())
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def stream_count_events_csv(queryset, chunk_size=2000):
+    """
+    Yield the count events as csv, chunk_size lines at a time.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS.keys())
+    rows = count_event_values(queryset, chunk_size)
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        yield "".join(
+            writer.writerow([datetime.strftime("%Y-%m-%d %H:%M:%S"), *values])
+            for datetime, *values in chunk
+        )
+
+
+def count_events_npz(queryset):
+    """
+    The count events as compressed numpy archive with one array per column,
+    e.g. for pandas.DataFrame(dict(numpy.load(file))). The datetimes are UTC,
+    missing counts are NaN. Text columns are dictionary encoded: column holds
+    the index of each value in column_values.
+    """
+    columns = {name: [] for name in COLUMNS}
+    for values in count_event_values(queryset):
+        for column, value in zip(columns.values(), values):
+            column.append(value)
+
+    arrays = {
+        "datetime": numpy.array(
+            [datetime.replace(tzinfo=None) for datetime in columns.pop("datetime")],
+            dtype="datetime64[s]",
+        ),
+        "variation": numpy.array(columns.pop("variation"), dtype=numpy.int64),
+        "count": numpy.array(
+            [numpy.nan if count is None else count for count in columns.pop("count")],
+            dtype=numpy.float64,
+        ),
+    }
+    for name, values in columns.items():
+        name = name.replace(" ", "_")
+        arrays[f"{name}_values"], arrays[name] = numpy.unique(
+            numpy.array(values, dtype=str), return_inverse=True
+        )
+
+    buffer = io.BytesIO()
+    numpy.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
@@ -0,0 +1,62 @@
+import datetime
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from hagrid.operations.models import EventTime
+from hagrid.products.count_queue import CountPriorities
+from hagrid.products.models import SizeVariation
+from hagrid.products.views.dashboard import get_current_open_status
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare CountPriorities against SizeVariation.get_count_priority on random, unsaved "
+        "variations of the current event, checking that both give the same results"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--variations", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        if not (open_status := get_current_open_status()):
+            raise CommandError("Must first configure open status")
+        event_time = EventTime(open_status.event)
+        now = timezone.now()
+        rng = random.Random(options["seed"])
+
+        variations = []
+        for _ in range(options["variations"]):
+            amount_initial = rng.choice([None, 0, rng.randint(1, 500)])
+            variations.append(
+                SizeVariation(
+                    count=rng.choice([None, 0, rng.randint(1, amount_initial or 500)]),
+                    amount_initial=amount_initial,
+                    counted_at=rng.choice([
+                        None,
+                        now - datetime.timedelta(seconds=rng.uniform(0, 4 * 24 * 3600)),
+                    ]),
+                    count_prio_bumped=rng.random() < 0.1,
+                )
+            )
+
+        start = time.perf_counter()
+        scalar = [variation.get_count_priority(event_time, now) for variation in variations]
+        scalar_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch = CountPriorities.for_variations(event_time, variations, now=now)
+        batch_duration = time.perf_counter() - start
+
+        mismatches = sum(1 for index, expected in enumerate(scalar) if batch[index] != expected)
+
+        self.stdout.write(f"variations:  {len(variations)}")
+        self.stdout.write(f"scalar:      {scalar_duration * 1000:.1f} ms")
+        self.stdout.write(f"batch:       {batch_duration * 1000:.1f} ms")
+        self.stdout.write(f"speedup:     {scalar_duration / batch_duration:.1f}x")
+        if mismatches:
+            raise CommandError(f"{mismatches} variations scored differently")
+        self.stdout.write(self.style.SUCCESS("all priorities match"))
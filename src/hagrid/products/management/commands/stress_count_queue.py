@@ -0,0 +1,93 @@
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+
+from hagrid.operations.models import EventTime
+from hagrid.products.count_queue import refresh_count_priorities
+from hagrid.products.models import CountAccessCode, SizeVariation
+from hagrid.products.views.dashboard import get_current_open_status
+
+
+class Command(BaseCommand):
+    help = (
+        "Let concurrent volunteers claim variations from the queue of an access code until it "
+        "is empty, checking that no variation is handed out twice. Reserves variations for "
+        "counting and resets them afterwards, so only runs with DEBUG enabled"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("code", help="the access code whose queue is claimed from")
+        parser.add_argument("--clients", type=int, default=8)
+        parser.add_argument(
+            "--claims", type=int, help="claims per client, default is until the queue is empty"
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError("Refusing to reserve variations for counting without DEBUG")
+        if not (open_status := get_current_open_status()):
+            raise CommandError("Must first configure open status")
+        try:
+            access_code = CountAccessCode.objects.get(code=options["code"])
+        except CountAccessCode.DoesNotExist:
+            raise CommandError("No such access code") from None
+
+        refresh_count_priorities(EventTime.for_event(open_status.event))
+        queued = set(access_code.queue.values_list("pk", flat=True))
+        reserved_until_before = dict(
+            SizeVariation.objects.filter(pk__in=queued).values_list("pk", "count_reserved_until")
+        )
+
+        claims = Counter()
+        results = {"claims": 0, "errors": 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(options["clients"])
+
+        def client():
+            barrier.wait()
+            try:
+                remaining = options["claims"]
+                while remaining is None or remaining > 0:
+                    try:
+                        variation = access_code.claim_next_variation()
+                    except OperationalError:
+                        # e.g. SQLite giving up waiting for its database lock
+                        with lock:
+                            results["errors"] += 1
+                        continue
+                    if variation is None:
+                        break
+                    with lock:
+                        claims[variation.pk] += 1
+                        results["claims"] += 1
+                    if remaining is not None:
+                        remaining -= 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client) for _ in range(options["clients"])]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            variations = list(SizeVariation.objects.filter(pk__in=claims))
+            for variation in variations:
+                variation.count_reserved_until = reserved_until_before.get(variation.pk)
+            SizeVariation.objects.bulk_update(variations, ["count_reserved_until"])
+
+        duplicates = {pk: count for pk, count in claims.items() if count > 1}
+        self.stdout.write(f"queued before:  {len(queued)}")
+        self.stdout.write(f"submits:        {results}")
+        self.stdout.write(f"distinct:       {len(claims)}")
+        if duplicates:
+            raise CommandError(f"Variations claimed more than once: {duplicates}")
+        if options["claims"] is None and not queued <= claims.keys():
+            raise CommandError(f"Queued variations never claimed: {queued - claims.keys()}")
+        if results["errors"]:
+            self.stdout.write(self.style.WARNING("some claims failed with database errors"))
+        self.stdout.write(self.style.SUCCESS("no variation was claimed twice"))
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.6 on 2026-10-18 05:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("products", "0004_countaccesscode_allow_automatic_availability"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sizevariation",
+            name="count_priority",
+            field=models.FloatField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_amount_reserved(apps, schema_editor):
+    SizeVariation = apps.get_model("products", "SizeVariation")
+    ReservationPosition = apps.get_model("reservations", "ReservationPosition")
+    SizeVariation.objects.bulk_update(
+        [
+            SizeVariation(pk=variation_id, amount_reserved=reserved)
+            for variation_id, reserved in ReservationPosition.objects
+            .values("variation")
+            .annotate(reserved=Sum("amount"))
+            .values_list("variation", "reserved")
+        ],
+        ["amount_reserved"],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("products", "0005_sizevariation_count_priority"),
+        ("reservations", "0002_reservation_event_alter_reservation_state_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sizevariation",
+            name="amount_reserved",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_amount_reserved, migrations.RunPython.noop),
+    ]
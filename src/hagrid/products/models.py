@@ -1,16 +1,16 @@
 import math
 import secrets
+from datetime import timedelta
 
-from django.db import models
-from django.db.models.signals import pre_save
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
-from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
-from django_eventstream import send_event
 from positions import PositionField
 
-from hagrid.operations.models import Event, EventTime
+from hagrid.operations.models import Event, EventTime, OpenStatus
 
 
 class StoreSettings(models.Model):
@@ -190,9 +190,85 @@ class SizeVariation(models.Model):
         null=True,
     )
 
+    # sum of the amounts of all reservation positions, only ever changed by
+    # hagrid.reservations.models.reserve_amounts so that concurrent
+    # reservations can't take more than amount_initial
+    amount_reserved = models.PositiveIntegerField(default=0, editable=False)
+
+    # total of get_count_priority, kept up to date by refresh_count_priorities
+    count_priority = models.FloatField(blank=True, null=True, db_index=True, editable=False)
+
+    # fields get_count_priority depends on (besides the time)
+    COUNT_PRIORITY_FIELDS = {"count", "counted_at", "amount_initial", "count_prio_bumped"}
+    # fields the stats time series depend on, besides the names of the related objects
+    TIME_SERIES_FIELDS = {"amount_initial", "design_variation", "size"}
+
+    loaded_availability = None
+    # field name -> value loaded from or last saved to the database, of the
+    # fields whose changes are acted on
+    loaded_values = None
+
     def __str__(self):
         return f"{self.design_variation!s} {self.size!s}"
 
+    def save(self, *args, update_fields=None, **kwargs):
+        full_save = update_fields is None and not self._state.adding
+        if full_save:
+            # never write back a possibly outdated amount_reserved
+            deferred = self.get_deferred_fields()
+            update_fields = {
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+            } - {"amount_reserved"}
+        if update_fields is None or self.changed_fields(
+            self.COUNT_PRIORITY_FIELDS.intersection(update_fields)
+        ):
+            # mark for re-scoring by the next refresh_count_priorities
+            self.count_priority = None
+            if update_fields is not None:
+                update_fields = {*update_fields, "count_priority"}
+        elif full_save:
+            # keep a priority refresh_count_priorities stored since loading
+            update_fields -= {"count_priority"}
+        super().save(*args, update_fields=update_fields, **kwargs)
+        self.loaded_values = {
+            **(self.loaded_values or {}),
+            **self.field_values(
+                name
+                for name in self.COUNT_PRIORITY_FIELDS | self.TIME_SERIES_FIELDS
+                if update_fields is None or name in update_fields
+            ),
+        }
+
+    def field_values(self, names):
+        return {name: getattr(self, self._meta.get_field(name).attname) for name in names}
+
+    def changed_fields(self, names):
+        """
+        The fields of names whose value differs from the one loaded from the
+        database, all of them for new instances.
+        """
+        loaded = self.loaded_values or {}
+        return {
+            name
+            for name, value in self.field_values(names).items()
+            if name not in loaded or value != loaded[name]
+        }
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the stored availability to detect transitions on save
+        instance.loaded_availability = instance.__dict__.get("availability")
+        # and the other stored values whose changes are acted on
+        instance.loaded_values = instance.field_values(
+            name
+            for name in cls.COUNT_PRIORITY_FIELDS | cls.TIME_SERIES_FIELDS
+            if cls._meta.get_field(name).attname in instance.__dict__
+        )
+        return instance
+
     @property
     def availability_progress(self):
         progress = 0
@@ -223,7 +299,7 @@ class SizeVariation(models.Model):
 
         return SizeVariation.STATE_MANY_AVAILABLE
 
-    def get_count_priority(self, event_time: EventTime):
+    def get_count_priority(self, event_time: EventTime, now=None):
         scores = {}
         info = {}
 
@@ -241,7 +317,7 @@ class SizeVariation(models.Model):
         elif not self.amount_initial:
             scores["invalid"] = 0
         else:
-            now = event_time.datetime_to_event_time(timezone.now())
+            now = event_time.datetime_to_event_time(timezone.now() if now is None else now)
 
             if self.count is None or self.counted_at is None:
                 # pretend we counted all items at t=0 with their amount_initial
@@ -403,46 +479,143 @@ class CountAccessCode(models.Model):
 
         return queryset
 
+    @property
+    def queue(self):
+        """
+        The variations that can be handed out for counting right now, most
+        important first. Priorities must be refreshed with
+        refresh_count_priorities before.
+        """
+        now = timezone.now()
+        variations = self.variations
+        return variations.filter(
+            ~Q(count=0)
+            & (Q(count_reserved_until__isnull=True) | Q(count_reserved_until__lt=now))
+            & (Q(count_disabled_until__isnull=True) | Q(count_disabled_until__lt=now))
+        ).order_by(F("count_priority").desc(nulls_last=True), *variations.query.order_by, "pk")
+
+    def claim_next_variation(self, reserve_for=timedelta(minutes=15)):
+        """
+        Reserve the first variation of the queue for counting and return it, or
+        None if there is nothing to count. Concurrent claims never return the
+        same variation.
+        """
+        while True:
+            with transaction.atomic():
+                # skip rows other claimers are looking at instead of waiting for them
+                variation = self.queue.select_for_update(skip_locked=True, of=("self",)).first()
+                if variation is None:
+                    return None
+
+                # only reserve the variation if nobody else did in the meantime, this
+                # also covers databases without row locks
+                now = timezone.now()
+                variation.count_reserved_until = now + reserve_for
+                if (
+                    SizeVariation.objects
+                    .filter(pk=variation.pk)
+                    .filter(Q(count_reserved_until__isnull=True) | Q(count_reserved_until__lt=now))
+                    .update(count_reserved_until=variation.count_reserved_until)
+                ):
+                    return variation
+
 
 @receiver(pre_save, sender=SizeVariation, dispatch_uid="variation_availability_change")
-def variation_availability_change(sender, instance, **kwargs):
-    new_instance = instance
-    try:
-        old_instance = SizeVariation.objects.get(pk=instance.pk)
-    except SizeVariation.DoesNotExist:
+def variation_availability_change(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (update_fields is not None and "availability" not in update_fields):
         return
-
-    if new_instance.availability != old_instance.availability:
-        AvailabilityEvent(
-            old_state=old_instance.availability,
-            new_state=new_instance.availability,
-            variation=instance,
-        ).save()
-        send_event(
-            "availability-display",
-            f"variation-{instance.id}",
-            data=render_to_string(
-                "dashboard/product_availability_tag.html",
-                {
-                    "variation": instance,
-                },
-            ),
-            json_encode=False,
-        )
-        # Availbility change form
-        from hagrid.products.views.config import VariationsAvailabilityForm
-
-        form = VariationsAvailabilityForm([instance])
-        field = form.field_for_rendering_by_variation(instance)
-        send_event(
-            "availability-form",
-            f"variation-{instance.id}",
-            data=render_to_string(
-                "operator/variation_availability_box.html",
-                {
-                    "field": field,
-                    "variation": instance,
-                },
-            ),
-            json_encode=False,
+    if instance.loaded_availability is None:
+        # instance was not loaded from the database or availability was deferred
+        instance.loaded_availability = (
+            SizeVariation.objects
+            .filter(pk=instance.pk)
+            .values_list("availability", flat=True)
+            .first()
         )
+
+
+@receiver(post_save, sender=SizeVariation, dispatch_uid="variation_availability_transition")
+def variation_availability_transition(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and "availability" not in update_fields:
+        return
+    old_availability = instance.loaded_availability
+    instance.loaded_availability = instance.availability
+    if not created and old_availability is not None and old_availability != instance.availability:
+        from hagrid.products.availability import track_availability_transition
+
+        track_availability_transition(instance, old_availability, instance.availability)
+
+
+@receiver(post_save, sender=SizeVariation, dispatch_uid="dashboard_snapshot_variation_save")
+def dashboard_snapshot_variation_save(sender, instance, created, **kwargs):
+    # availability changes of existing variations are patched into the snapshot
+    # by the availability transitions, only new variations need a rebuild
+    if created:
+        dashboard_snapshot_change(sender, **kwargs)
+
+
+@receiver(post_save, sender=Event, dispatch_uid="dashboard_snapshot_event_save")
+@receiver(post_delete, sender=Event, dispatch_uid="dashboard_snapshot_event_delete")
+@receiver(post_save, sender=OpenStatus, dispatch_uid="dashboard_snapshot_open_status_save")
+@receiver(post_delete, sender=OpenStatus, dispatch_uid="dashboard_snapshot_open_status_delete")
+@receiver(
+    m2m_changed,
+    sender=OpenStatus.selling_items_from.through,
+    dispatch_uid="dashboard_snapshot_open_status_selling_items_from",
+)
+@receiver(post_save, sender=Product, dispatch_uid="dashboard_snapshot_product_save")
+@receiver(post_delete, sender=Product, dispatch_uid="dashboard_snapshot_product_delete")
+@receiver(post_save, sender=Size, dispatch_uid="dashboard_snapshot_size_save")
+@receiver(post_delete, sender=Size, dispatch_uid="dashboard_snapshot_size_delete")
+@receiver(post_save, sender=Design, dispatch_uid="dashboard_snapshot_design_save")
+@receiver(post_delete, sender=Design, dispatch_uid="dashboard_snapshot_design_delete")
+@receiver(post_save, sender=DesignVariation, dispatch_uid="dashboard_snapshot_dv_save")
+@receiver(post_delete, sender=DesignVariation, dispatch_uid="dashboard_snapshot_dv_delete")
+@receiver(post_delete, sender=SizeVariation, dispatch_uid="dashboard_snapshot_variation_delete")
+@receiver(post_save, sender=Price, dispatch_uid="dashboard_snapshot_price_save")
+@receiver(post_delete, sender=Price, dispatch_uid="dashboard_snapshot_price_delete")
+@receiver(post_save, sender="gallery.GalleryImage", dispatch_uid="dashboard_snapshot_image_save")
+@receiver(
+    post_delete, sender="gallery.GalleryImage", dispatch_uid="dashboard_snapshot_image_delete"
+)
+def dashboard_snapshot_change(sender, **kwargs):
+    from hagrid.products.views.dashboard import invalidate_dashboard_snapshot
+
+    transaction.on_commit(invalidate_dashboard_snapshot)
+
+
+@receiver(post_save, sender=CountEvent, dispatch_uid="stats_time_series_count_event_save")
+@receiver(post_delete, sender=CountEvent, dispatch_uid="stats_time_series_count_event_delete")
+@receiver(post_save, sender=AvailabilityEvent, dispatch_uid="stats_time_series_avail_event_save")
+@receiver(
+    post_delete, sender=AvailabilityEvent, dispatch_uid="stats_time_series_avail_event_delete"
+)
+def stats_time_series_event_change(sender, created=False, **kwargs):
+    from hagrid.products.time_series import bump_stats_time_series_version
+
+    # new events are read by StatsTimeSeries.update, only changes need a rebuild
+    if not created:
+        transaction.on_commit(bump_stats_time_series_version)
+
+
+@receiver(post_save, sender=SizeVariation, dispatch_uid="stats_variations_variation_save")
+def stats_variations_variation_save(sender, instance, created, **kwargs):
+    from hagrid.products.time_series import bump_stats_variations_version
+
+    # counts and availabilities are read from their events, only the label and
+    # amount_initial of the variations are loaded from them
+    if created or instance.changed_fields(SizeVariation.TIME_SERIES_FIELDS):
+        transaction.on_commit(bump_stats_variations_version)
+
+
+@receiver(post_delete, sender=SizeVariation, dispatch_uid="stats_variations_variation_delete")
+@receiver(post_save, sender=DesignVariation, dispatch_uid="stats_variations_dv_save")
+@receiver(post_save, sender=Design, dispatch_uid="stats_variations_design_save")
+@receiver(post_save, sender=Product, dispatch_uid="stats_variations_product_save")
+@receiver(post_save, sender=Size, dispatch_uid="stats_variations_size_save")
+@receiver(post_save, sender=Event, dispatch_uid="stats_variations_event_save")
+def stats_variations_change(sender, **kwargs):
+    from hagrid.products.time_series import bump_stats_variations_version
+
+    # renames change the labels, deletes cascade to the variations
+    transaction.on_commit(bump_stats_variations_version)
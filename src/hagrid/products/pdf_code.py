@@ -2,7 +2,6 @@ import logging
 import os.path
 from io import BytesIO
 
-import qrcode
 from django.conf import settings
 from reportlab.lib.colors import black
 from reportlab.lib.pagesizes import A4
@@ -13,6 +12,8 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 from reportlab.platypus import Paragraph
 
+from .qr_codes import draw_qr_code
+
 logger = logging.getLogger(__name__)
 
 
@@ -96,35 +97,16 @@ class Document:
         return pdf_bytes
 
 
-def generate_qr_code(link: str):
-    qr = qrcode.QRCode(
-        version=None,
-        # error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=20,
-        border=4,
-    )
-    qr.add_data(link)
-    qr.make(fit=True)
-    return qr.make_image()
-
-
 def generate_access_code_pdf(request, access_codes, filename: str):
     doc = Document(filename)
 
     # Render QR Code next to the comment
     for access_code in access_codes:
         url = f"{settings.SITE_URL}{access_code.get_absolute_url()}"
-        qr_image = generate_qr_code(url)
         qr_code_size = 50 * mm
         if doc.y < qr_code_size + doc.mb:
             doc.new_page()
-        doc.canvas.drawInlineImage(
-            qr_image,
-            doc.x,
-            doc.y - qr_code_size,
-            qr_code_size,
-            qr_code_size,
-        )
+        draw_qr_code(doc.canvas, url, doc.x, doc.y - qr_code_size, qr_code_size, box_size=20)
         doc.canvas.rect(
             doc.x,
             doc.y - qr_code_size,
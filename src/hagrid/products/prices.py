@@ -0,0 +1,40 @@
+from django.utils.functional import cached_property
+
+from hagrid.operations.models import Event
+from hagrid.products.models import Price
+from hagrid.products.views.dashboard import get_current_open_status
+
+
+class PriceResolver:
+    """
+    Looks up the prices of variations at an event, by default the event of
+    the current open status. All prices valid at that event are loaded with
+    a single query when the first price is looked up.
+    """
+
+    def __init__(self, valid_at: Event | None = None):
+        if valid_at is not None:
+            self.valid_at = valid_at
+
+    @cached_property
+    def valid_at(self):
+        status = get_current_open_status()
+        return status.event if status else None
+
+    @cached_property
+    def prices(self):
+        """
+        (product id, id of the event the product is from) -> amount
+        """
+        if self.valid_at is None:
+            return {}
+        return {
+            (product_id, from_event_id): amount
+            for product_id, from_event_id, amount in Price.objects.filter(
+                valid_at=self.valid_at
+            ).values_list("product_id", "valid_for_products_from_event_id", "amount")
+        }
+
+    def get(self, variation):
+        design_variation = variation.design_variation
+        return self.prices.get((design_variation.product_id, design_variation.design.event_id))
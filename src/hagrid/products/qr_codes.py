@@ -0,0 +1,93 @@
+import functools
+import hashlib
+import logging
+import os
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def qr_code_key(link: str, error_correction: int, box_size: int, border: int):
+    return hashlib.sha256(f"{error_correction}:{box_size}:{border}:{link}".encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=1024)
+def qr_code_png(
+    link: str,
+    error_correction: int = qrcode.constants.ERROR_CORRECT_M,
+    box_size: int = 10,
+    border: int = 4,
+) -> bytes:
+    """
+    The QR code of a link as 1-bit PNG, cached in memory and, if
+    QR_CODE_CACHE_DIR is configured, on disk.
+    """
+    path = None
+    if settings.QR_CODE_CACHE_DIR:
+        key = qr_code_key(link, error_correction, box_size, border)
+        path = os.path.join(settings.QR_CODE_CACHE_DIR, key[:2], f"{key}.png")
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=error_correction,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(link)
+    qr.make(fit=True)
+    buffer = BytesIO()
+    qr.make_image().get_image().convert("1").save(buffer, format="PNG")
+    png = buffer.getvalue()
+
+    if path is not None:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary file first, so concurrent readers never see half a file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.exception("Could not write QR code cache file %s", path)
+
+    return png
+
+
+def draw_qr_code(
+    canvas,
+    link: str,
+    x,
+    y,
+    size,
+    error_correction: int = qrcode.constants.ERROR_CORRECT_M,
+    box_size: int = 10,
+    border: int = 4,
+):
+    """
+    Draw the QR code of a link into a size x size square at x, y.
+
+    The image is embedded once per document as form XObject, further
+    drawings of the same code only reference it.
+    """
+    name = f"qr-{qr_code_key(link, error_correction, box_size, border)[:32]}"
+    if not canvas.hasForm(name):
+        image = Image.open(BytesIO(qr_code_png(link, error_correction, box_size, border)))
+        canvas.beginForm(name, lowerx=0, lowery=0, upperx=1, uppery=1)
+        # inline images keep the 1 bit per pixel, drawImage would expand them to RGB
+        canvas.drawInlineImage(image, 0, 0, 1, 1)
+        canvas.endForm()
+
+    canvas.saveState()
+    canvas.translate(x, y)
+    canvas.scale(size, size)
+    canvas.doForm(name)
+    canvas.restoreState()
@@ -1,5 +1,6 @@
 from .models import (
     DesignVariation,
+    Size,
     SizeVariation,
 )
 
@@ -9,6 +10,13 @@ class ProductTable:
     A table where the rows are design variants of a product
     and the columns sizes of the associated size scale.
     Can be limited to designs of specific events.
+
+    Design variations, sizes and size variations are queried unless they are
+    passed in, see ProductTableSet.
+
+    With a cell_template, render_variation and render_empty return the context
+    of a cell instead of its HTML (or None for an empty cell), and the cells
+    are rendered by including cell_template while product_table.html renders.
     """
 
     def __init__(
@@ -20,31 +28,39 @@ class ProductTable:
         render_empty=None,
         show_empty_rows=False,
         table_class: str = "",
+        cell_template: str | None = None,
+        design_variations=None,
+        sizes=None,
+        variations=None,
     ):
         self.title = title
         self.product = product
         self.only_events_in = only_events_in
         self.table_class = table_class
         self.show_empty_rows = show_empty_rows
+        self.cell_template = cell_template
         self.render_variation = render_variation or (lambda v: v.availability)
-        self.render_empty = render_empty or (lambda *_args: "")
+        self.render_empty = render_empty or (lambda *_args: None if cell_template else "")
 
-        self.rows = list(self.generate_rows())
+        self.rows = list(self.generate_rows(design_variations, sizes, variations))
 
-    def generate_rows(self):
-        design_variations = DesignVariation.objects.filter(
-            product=self.product,
-        )
-        if self.only_events_in is not None:
-            design_variations = design_variations.filter(design__event__in=self.only_events_in)
-        bool(design_variations)
-        sizes = self.product.size_scale.sizes.all()
-        bool(sizes)
+    def generate_rows(self, design_variations=None, sizes=None, all_variations=None):
+        if design_variations is None:
+            design_variations = DesignVariation.objects.filter(
+                product=self.product,
+            )
+            if self.only_events_in is not None:
+                design_variations = design_variations.filter(design__event__in=self.only_events_in)
+            bool(design_variations)
+        if sizes is None:
+            sizes = self.product.size_scale.sizes.all()
+            bool(sizes)
 
-        all_variations = {
-            (v.design_variation_id, v.size_id): v
-            for v in SizeVariation.objects.filter(design_variation__in=design_variations)
-        }
+        if all_variations is None:
+            all_variations = {
+                (v.design_variation_id, v.size_id): v
+                for v in SizeVariation.objects.filter(design_variation__in=design_variations)
+            }
 
         for design_variation in design_variations:
             row = {
@@ -58,19 +74,89 @@ class ProductTable:
                     row["variations"].append({
                         "size": size,
                         "variation": variation,
-                        "html": self.render_variation(variation),
+                        self.cell_key: self.render_variation(variation),
                     })
                     found_variation = True
                 except KeyError:
                     row["variations"].append({
                         "size": size,
                         "variation": None,
-                        "html": self.render_empty(design_variation, size),
+                        self.cell_key: self.render_empty(design_variation, size),
                     })
             if found_variation or self.show_empty_rows:
                 yield row
 
+    @property
+    def cell_key(self):
+        return "context" if self.cell_template else "html"
+
     @property
     def column_width(self):
         return "200"
         # return f"{100/(self.column_count + 1):.1f}%"
+
+
+class ProductTableSet:
+    """
+    The product tables of several products for several groups of events
+    (iterables of events, or None for all events), titled
+    "{label} {product name}". Everything is loaded with a fixed number of
+    queries and partitioned into the tables, which are ordered by event group
+    and then by product. Tables without rows are left out.
+
+    The remaining keyword arguments are passed on to every ProductTable.
+    """
+
+    def __init__(self, products, event_groups, **table_kwargs):
+        self.products = list(products)
+        self.event_groups = [
+            (None if events is None else {event.pk for event in events}, label)
+            for events, label in event_groups
+        ]
+        self.table_kwargs = table_kwargs
+        self.tables = list(self.generate_tables())
+
+    def generate_tables(self):
+        products = {product.pk: product for product in self.products}
+
+        sizes = {}
+        for size in Size.objects.filter(scale__products__in=self.products).distinct():
+            sizes.setdefault(size.scale_id, []).append(size)
+
+        design_variations = {}
+        design_variations_by_id = {}
+        for design_variation in (
+            DesignVariation.objects
+            .filter(product__in=self.products)
+            .select_related("design__event")
+            .order_by("pk")
+        ):
+            design_variation.product = products[design_variation.product_id]
+            design_variations.setdefault(design_variation.product_id, []).append(design_variation)
+            design_variations_by_id[design_variation.pk] = design_variation
+
+        sizes_by_id = {size.pk: size for scale_sizes in sizes.values() for size in scale_sizes}
+        variations = {}
+        for variation in SizeVariation.objects.filter(design_variation__product__in=self.products):
+            variation.design_variation = design_variations_by_id[variation.design_variation_id]
+            if variation.size_id in sizes_by_id:
+                variation.size = sizes_by_id[variation.size_id]
+            variations[(variation.design_variation_id, variation.size_id)] = variation
+
+        for events, label in self.event_groups:
+            for product in self.products:
+                table = ProductTable(
+                    title=f"{label} {product.name}",
+                    product=product,
+                    only_events_in=events,
+                    design_variations=[
+                        design_variation
+                        for design_variation in design_variations.get(product.pk, [])
+                        if events is None or design_variation.design.event_id in events
+                    ],
+                    sizes=sizes.get(product.size_scale_id, []),
+                    variations=variations,
+                    **self.table_kwargs,
+                )
+                if table.rows:
+                    yield table
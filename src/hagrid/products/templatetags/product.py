@@ -8,6 +8,19 @@ from hagrid.products.models import SizeVariation
 register = template.Library()
 
 
+@register.simple_tag(takes_context=True)
+def product_table_cell(context, table, cell):
+    """
+    Render a cell of a ProductTable with a cell_template as part of the
+    surrounding template, like an include with the context of the cell.
+    """
+    if cell["context"] is None:
+        return ""
+    template = context.template.engine.get_template(table.cell_template)
+    with context.push(**cell["context"]):
+        return template.render(context)
+
+
 @register.filter
 def availability_class(availability):
     if availability == SizeVariation.STATE_MANY_AVAILABLE:
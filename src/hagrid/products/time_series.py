@@ -0,0 +1,276 @@
+import math
+import time
+from datetime import timedelta
+
+import numpy
+from django.core.cache import cache
+
+from hagrid.operations.models import EVENT_TIME_VERSION_KEY, EventTime
+from hagrid.products.models import AvailabilityEvent, CountEvent, SizeVariation
+
+# bumped whenever count or availability events are changed or deleted, see
+# StatsTimeSeries.for_event. New events are folded in without a bump.
+STATS_TIME_SERIES_VERSION_KEY = "stats-time-series-version"
+# bumped whenever variations are added, removed, renamed or get a different
+# amount_initial, the variations are only reloaded then
+STATS_VARIATIONS_VERSION_KEY = "stats-time-series-variations-version"
+STATS_TIME_SERIES_TIMEOUT = 24 * 60 * 60
+
+MAX_FIT_DEGREE = 2
+STOCK_INTERVAL = 5 * 60
+SALE_RATE_INTERVAL = 60 * 60
+
+# events are re-read for this long (in seconds) after newer ones were seen,
+# to catch events of transactions that committed after a later id
+EVENT_OVERLAP = 60
+
+AVAILABILITY_VALUES = {
+    SizeVariation.STATE_MANY_AVAILABLE: 2,
+    SizeVariation.STATE_FEW_AVAILABLE: 1,
+    SizeVariation.STATE_SOLD_OUT: 0,
+}
+
+
+class StatsTimeSeries:
+    """
+    The stock and sale rate series and the availability timelines of the
+    stats page for one event.
+
+    Only the count and availability events that were added since the last
+    update are read, and only the variations they belong to are refitted.
+    """
+
+    def __init__(self, event_time: EventTime):
+        self.event_time = event_time
+        self.variations_version = None
+        self.count_events = NewEvents(CountEvent, "variation_id", "count")
+        self.availability_events = NewEvents(AvailabilityEvent, "variation_id", "new_state")
+
+        # variation id -> (label, amount_initial), in display order, None
+        # until the first update
+        self.variations = None
+        # variation id -> {event time: count or availability value}
+        self.count_points = {}
+        self.availability_points = {}
+        # variation id -> coefficients of its fitted stock polynomial
+        self.coefficients = {}
+        # variation id -> [(start, end, availability value)]
+        self.intervals = {}
+
+        self.stock_times = numpy.array([])
+        self.stock = numpy.array([])
+        self.rate = numpy.array([])
+
+    @classmethod
+    def for_event(cls, event):
+        event_time = EventTime.for_event(event)
+        version_keys = [
+            EVENT_TIME_VERSION_KEY,
+            STATS_TIME_SERIES_VERSION_KEY,
+            STATS_VARIATIONS_VERSION_KEY,
+        ]
+        versions = cache.get_many(version_keys)
+        if len(versions) < len(version_keys):
+            # start from the time, so an evicted version never resurrects old series
+            for version_key in version_keys:
+                cache.add(version_key, time.time_ns(), None)
+            versions = cache.get_many(version_keys)
+        event_time_version = versions[EVENT_TIME_VERSION_KEY]
+        version = versions[STATS_TIME_SERIES_VERSION_KEY]
+        key = f"stats-time-series-{event.pk}-{event_time_version}-{version}"
+        if (series := cache.get(key)) is None:
+            series = cls(event_time)
+        if series.update(versions[STATS_VARIATIONS_VERSION_KEY]):
+            cache.set(key, series, STATS_TIME_SERIES_TIMEOUT)
+        return series
+
+    def update(self, variations_version=None):
+        """
+        Fold in new events and changed variations, returns whether anything
+        changed. The variations are only reloaded if variations_version
+        differs from the one of the last update, or if it is None.
+        """
+        refit = set()
+        changed = False
+        if variations_version is None or variations_version != self.variations_version:
+            variations = {
+                variation.pk: (str(variation), variation.amount_initial)
+                for variation in SizeVariation.objects.select_related(
+                    "design_variation__design__event", "design_variation__product", "size"
+                ).order_by("pk")
+            }
+            previous = self.variations or {}
+            refit = {
+                pk
+                for pk, (_, amount_initial) in variations.items()
+                if pk not in previous or previous[pk][1] != amount_initial
+            }
+            changed = variations != self.variations
+            self.variations = variations
+            self.variations_version = variations_version
+        variations = self.variations
+
+        count_events = self.count_events.read()
+        if count_events:
+            times = self.event_time.timestamps_to_event_times([
+                dt.timestamp() for dt, _, _ in count_events
+            ]).tolist()
+            for (_, variation_id, count), time in zip(count_events, times):
+                self.count_points.setdefault(variation_id, {})[time] = count
+                refit.add(variation_id)
+
+        availability_events = self.availability_events.read()
+        redraw = set()
+        if availability_events:
+            times = self.event_time.timestamps_to_event_times([
+                dt.timestamp() for dt, _, _ in availability_events
+            ]).tolist()
+            for (_, variation_id, new_state), time in zip(availability_events, times):
+                points = self.availability_points.setdefault(variation_id, {0.0: 2})
+                points[time] = AVAILABILITY_VALUES[new_state]
+                redraw.add(variation_id)
+
+        for pk in refit & variations.keys():
+            self.coefficients[pk] = self.fit_stock(pk)
+        for pk in (redraw | (variations.keys() - self.intervals.keys())) & variations.keys():
+            self.intervals[pk] = self.availability_intervals(pk)
+
+        if changed or refit:
+            # removed variations change the sum as well
+            self.update_stock_and_rate()
+        return bool(changed or refit or redraw)
+
+    def fit_stock(self, variation_id):
+        xy = dict(self.count_points.get(variation_id, {}))
+
+        # pretend full sale at end of event if we never counted
+        if not xy:
+            xy[self.event_time.total_event_duration] = 0
+
+        # track start value
+        xy[0] = self.variations[variation_id][1]
+
+        xy = numpy.array(sorted(xy.items()))
+
+        degree = min(MAX_FIT_DEGREE, xy.shape[0] - 1)
+        poly = numpy.polynomial.Polynomial.fit(xy[:, 0], xy[:, 1], degree)
+        return poly.convert().coef
+
+    def availability_intervals(self, variation_id):
+        avail = sorted(self.availability_points.get(variation_id, {0.0: 2}).items())
+        avail.append((self.event_time.total_event_duration, avail[-1][1]))
+        return [(x, x2, v) for (x, v), (x2, _) in pairs(avail)]
+
+    def update_stock_and_rate(self):
+        coefficients = numpy.zeros((MAX_FIT_DEGREE + 1,))
+        for pk in self.variations:
+            coef = self.coefficients[pk]
+            coefficients[: len(coef)] += coef
+
+        @numpy.vectorize
+        def get_stock_at(x):
+            return sum(c * pow(x, i) for i, c in enumerate(coefficients))
+
+        # Calculate the derivative (rate of change) of the stock polynomial
+        # This gives us the sales rate directly
+        @numpy.vectorize
+        def get_sale_rate_at(x):
+            # Derivative of polynomial: d/dx (c0 + c1*x + c2*x^2) = c1 + 2*c2*x
+            return -sum(i * c * pow(x, i - 1) for i, c in enumerate(coefficients) if i > 0)
+
+        steps = math.ceil(self.event_time.total_event_duration / STOCK_INTERVAL)
+        self.stock_times = numpy.arange(steps) * STOCK_INTERVAL
+        if len(self.stock_times) > 0:
+            self.stock = get_stock_at(self.stock_times)
+        else:
+            self.stock = numpy.array([])
+
+        steps = math.ceil(self.event_time.total_event_duration / SALE_RATE_INTERVAL)
+        rate_times = numpy.arange(steps) * SALE_RATE_INTERVAL
+        if len(rate_times) > 0:
+            # Use the derivative to get the instantaneous rate (items per second)
+            # Then convert to items per hour by multiplying by 3600
+            self.rate = get_sale_rate_at(rate_times) * 3600
+        else:
+            self.rate = numpy.array([])
+
+    @property
+    def availabilities(self):
+        return [
+            {
+                "variation": label,
+                "timeline": [{"x": x, "x2": x2, "y": i, "v": v} for x, x2, v in self.intervals[pk]],
+            }
+            for i, (pk, (label, _)) in enumerate(self.variations.items())
+        ]
+
+
+class NewEvents:
+    """
+    Reads the events of a model that weren't read before, as tuples of their
+    datetime and the given fields, in id order.
+
+    Ids are handed out before commit, so an event can show up after events
+    with a higher id. Instead of only reading above the highest id seen, the
+    events of the last EVENT_OVERLAP seconds are read again and the ones
+    already seen are skipped.
+    """
+
+    def __init__(self, model, *fields):
+        self.model = model
+        self.fields = fields
+        # events up to this id are older than the overlap and never read again
+        self.read_until_id = 0
+        # id -> datetime of the events read above read_until_id
+        self.seen = {}
+
+    def read(self):
+        rows = (
+            self.model.objects
+            .filter(id__gt=self.read_until_id)
+            .order_by("id")
+            .values_list("id", "datetime", *self.fields)
+        )
+        events = []
+        for pk, datetime, *values in rows:
+            if pk not in self.seen:
+                self.seen[pk] = datetime
+                events.append((datetime, *values))
+
+        if self.seen:
+            cutoff = max(self.seen.values()) - timedelta(seconds=EVENT_OVERLAP)
+            if older := [pk for pk, datetime in self.seen.items() if datetime < cutoff]:
+                self.read_until_id = max(older)
+                self.seen = {pk: dt for pk, dt in self.seen.items() if pk > self.read_until_id}
+        return events
+
+
+def pairs(it):
+    """Iterate over pairs (tuples of consecutive items, overlapping) from the
+    original iterator.
+    """
+    i = iter(it)
+    try:
+        prev = next(i)
+        while True:
+            cur = next(i)
+            yield prev, cur
+            prev = cur
+    except StopIteration:
+        pass
+
+
+def bump_stats_time_series_version():
+    try:
+        cache.incr(STATS_TIME_SERIES_VERSION_KEY)
+    except ValueError:
+        # evicted or never stored, start over from the time
+        cache.add(STATS_TIME_SERIES_VERSION_KEY, time.time_ns(), None)
+
+
+def bump_stats_variations_version():
+    try:
+        cache.incr(STATS_VARIATIONS_VERSION_KEY)
+    except ValueError:
+        # evicted or never stored, start over from the time
+        cache.add(STATS_VARIATIONS_VERSION_KEY, time.time_ns(), None)
@@ -2,16 +2,15 @@ from django import forms
 from django.contrib import messages
 from django.contrib.auth.views import login_required
 from django.db import transaction
-from django.db.models import Max, Min
 from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, redirect, render
-from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
 from django.views.decorators.http import require_GET, require_http_methods
 from django.views.generic import FormView
 
 from hagrid.operations.models import Event, OpenStatus
+from hagrid.products.availability import track_availability_transition
 from hagrid.products.models import (
     AvailabilityEvent,
     CountEvent,
@@ -21,8 +20,11 @@ from hagrid.products.models import (
     ProductCategory,
     SizeVariation,
 )
-from hagrid.products.tables import ProductTable
-from hagrid.products.views.dashboard import get_current_open_status
+from hagrid.products.tables import ProductTableSet
+from hagrid.products.views.dashboard import (
+    get_current_open_status,
+    invalidate_dashboard_snapshot,
+)
 
 
 class SizeVariationConfigForm(forms.ModelForm):
@@ -46,9 +48,7 @@ def size_variation_config(request, product_id=None):
     variation_forms = []
 
     def render_form(form, variation=None):
-        return render_to_string(
-            "operator/size_variation_config_box.html", context={"form": form}, request=request
-        )
+        return {"form": form}
 
     def render_variation_form(size_variation):
         prefix = f"variation-{size_variation.design_variation_id}-{size_variation.size_id}"
@@ -75,24 +75,17 @@ def size_variation_config(request, product_id=None):
     if not open_status:
         raise Http404("Must first configure open status")
     current_event = open_status.event
-    tables = [
-        table
-        for event_groups, label in [
+    tables = ProductTableSet(
+        products,
+        [
             ({current_event}, current_event.name),
             (set(Event.objects.all()) - {current_event}, "old"),
-        ]
-        for product in products
-        if (
-            table := ProductTable(
-                title=f"{label} {product.name}",
-                product=product,
-                only_events_in=event_groups,
-                render_variation=render_variation_form,
-                render_empty=render_empty_form,
-                show_empty_rows=True,
-            )
-        ).rows
-    ]
+        ],
+        render_variation=render_variation_form,
+        render_empty=render_empty_form,
+        show_empty_rows=True,
+        cell_template="operator/size_variation_config_box.html",
+    ).tables
 
     if request.POST and all(f.is_valid() for f in variation_forms):
         changed_count = 0
@@ -172,53 +165,49 @@ def variation_availability_config(request, product_id=None):
     products = Product.objects.all()
     if product_id is not None:
         products = products.filter(id=product_id)
+    elif request.method == "GET" and "lazy" in request.GET:
+        # only the product sections, htmx loads their tables when expanded
+        return render(
+            request,
+            "operator/variation_availability_config.html",
+            {"products": products, "lazy": True},
+        )
     variations = list(SizeVariation.objects.filter(design_variation__product__in=products).all())
 
     form = VariationsAvailabilityForm(variations, request.POST or None)
 
     def render_variation_form(variation):
-        field = form.field_for_rendering_by_variation(variation)
-        return render_to_string(
-            "operator/variation_availability_box.html",
-            context={"field": field, "variation": variation},
-            request=request,
-        )
-
-    def render_empty_form(product, size):
-        return ""
+        return {"field": form.field_for_rendering_by_variation(variation), "variation": variation}
 
     open_status = get_current_open_status()
     current_event = open_status.event if open_status else Event.objects.order_by("-day_1").first()
-    tables = [
-        table
-        for event_groups, label in [
+    tables = ProductTableSet(
+        products,
+        [
             ({current_event}, current_event.name),
             (set(Event.objects.all()) - {current_event}, "old"),
-        ]
-        for product in products
-        if (
-            table := ProductTable(
-                title=f"{label} {product.name}",
-                product=product,
-                only_events_in=event_groups,
-                render_variation=render_variation_form,
-                render_empty=render_empty_form,
-                show_empty_rows=False,
-                table_class="availabilities-table",
-            )
-        ).rows
-    ]
+        ],
+        render_variation=render_variation_form,
+        show_empty_rows=False,
+        table_class="availabilities-table",
+        cell_template="operator/variation_availability_box.html",
+    ).tables
 
     if request.POST and form.is_valid():
+        availabilities = {
+            int(key.rsplit("_", 1)[-1]): value for key, value in form.cleaned_data.items()
+        }
         with transaction.atomic():
-            changed_count = 0
-            for key, value in form.cleaned_data.items():
-                variation_id = int(key.rsplit("_", 1)[-1])
-                variation = get_object_or_404(SizeVariation, id=variation_id)
-                if variation.availability != value:
-                    variation.availability = value
-                    variation.save()
-                    changed_count += 1
+            changed = []
+            for variation in SizeVariation.objects.in_bulk(availabilities).values():
+                availability = availabilities[variation.pk]
+                if variation.availability != availability:
+                    # recorded and broadcast once for all changes after the commit
+                    track_availability_transition(variation, variation.availability, availability)
+                    variation.availability = availability
+                    changed.append(variation)
+            SizeVariation.objects.bulk_update(changed, ["availability"], batch_size=500)
+        changed_count = len(changed)
         messages.add_message(
             request,
             messages.SUCCESS,
@@ -230,7 +219,10 @@ def variation_availability_config(request, product_id=None):
             else redirect("variation_availability_config")
         )
 
-    context = {"tables": tables}
+    context = {"tables": tables, "product_id": product_id}
+    if request.htmx:
+        # a product section of the lazy page
+        return render(request, "product_tables.html", context)
     return render(request, "operator/variation_availability_config.html", context)
 
 
@@ -273,64 +265,69 @@ def variation_count_config(request, product_id=None):
     products = Product.objects.all()
     if product_id is not None:
         products = products.filter(id=product_id)
+    elif request.method == "GET" and "lazy" in request.GET:
+        # only the product sections, htmx loads their tables when expanded
+        return render(
+            request, "operator/variation_count_config.html", {"products": products, "lazy": True}
+        )
     variations = list(SizeVariation.objects.filter(design_variation__product__in=products).all())
 
     form = VariationsCountForm(variations, request.POST or None)
 
     def render_variation_form(variation):
-        field = form.field_for_rendering_by_variation(variation)
-        return render_to_string(
-            "counting/variation_count_box.html",
-            context={"field": field, "variation": variation},
-            request=request,
-        )
-
-    def render_empty_form(product, size):
-        return ""
+        return {"field": form.field_for_rendering_by_variation(variation), "variation": variation}
 
     open_status = get_current_open_status()
     current_event = open_status.event if open_status else Event.objects.order_by("-day_1").first()
-    tables = [
-        table
-        for event_groups, label in [
+    tables = ProductTableSet(
+        products,
+        [
             ({current_event}, current_event.name),
             (set(Event.objects.all()) - {current_event}, "old"),
-        ]
-        for product in products
-        if (
-            table := ProductTable(
-                title=f"{label} {product.name}",
-                product=product,
-                only_events_in=event_groups,
-                render_variation=render_variation_form,
-                render_empty=render_empty_form,
-                show_empty_rows=False,
-                table_class="count-config-table",
-            )
-        ).rows
-    ]
+        ],
+        render_variation=render_variation_form,
+        show_empty_rows=False,
+        table_class="count-config-table",
+        cell_template="counting/variation_count_box.html",
+    ).tables
 
     if request.POST and form.is_valid():
+        counts = {
+            int(key.rsplit("_", 1)[-1]): value
+            for key, value in form.cleaned_data.items()
+            if value is not None
+        }
         with transaction.atomic():
             now = timezone.now()
-            items_changed = 0
-
-            for key, value in form.cleaned_data.items():
-                variation_id = int(key.rsplit("_", 1)[-1])
-                variation = get_object_or_404(SizeVariation, id=variation_id)
-                if value is not None and variation.count != value:
-                    variation.count = value
+            changed = []
+            for variation in SizeVariation.objects.in_bulk(counts).values():
+                if variation.count != counts[variation.pk]:
+                    variation.count = counts[variation.pk]
                     variation.count_reserved_until = None
                     variation.count_disabled_until = None
                     variation.count_disabled_reason = None
                     variation.counted_at = now
                     variation.count_prio_bumped = False
-                    variation.save()
-                    CountEvent(
-                        count=value,
-                        variation=variation,
-                    ).save()
-                    items_changed += 1
+                    # mark for re-scoring, like SizeVariation.save
+                    variation.count_priority = None
+                    changed.append(variation)
+            SizeVariation.objects.bulk_update(
+                changed,
+                [
+                    "count",
+                    "count_reserved_until",
+                    "count_disabled_until",
+                    "count_disabled_reason",
+                    "counted_at",
+                    "count_prio_bumped",
+                    "count_priority",
+                ],
+                batch_size=500,
+            )
+            CountEvent.objects.bulk_create([
+                CountEvent(count=variation.count, variation=variation) for variation in changed
+            ])
+        items_changed = len(changed)
         messages.info(request, f"Updated {items_changed} item counts.")
         return (
             redirect("variation_count_config", product_id)
@@ -338,7 +335,10 @@ def variation_count_config(request, product_id=None):
             else redirect("variation_count_config")
         )
 
-    context = {"tables": tables}
+    context = {"tables": tables, "product_id": product_id}
+    if request.htmx:
+        # a product section of the lazy page
+        return render(request, "product_tables.html", context)
     return render(request, "operator/variation_count_config.html", context)
 
 
@@ -393,22 +393,30 @@ class EventPricesForm(forms.Form):
 
         super().__init__(*args, **kwargs)
 
-        self.products = Product.objects.all()
+        self.products = list(Product.objects.all())
         self.current_products_keys = []
         self.old_products_keys = []
-        self.old_events = Event.objects.all().exclude(id=self.event.id)
+        self.old_events = list(Event.objects.all().exclude(id=self.event.id))
+
+        # (product id, event id) of all products with designs of that event
+        design_events = set(
+            DesignVariation.objects.values_list("product_id", "design__event_id").distinct()
+        )
+        # (product id, id of the event the product is from) -> amount
+        self.prices = {
+            (product_id, from_event_id): amount
+            for product_id, from_event_id, amount in Price.objects.filter(
+                valid_at=self.event
+            ).values_list("product_id", "valid_for_products_from_event_id", "amount")
+        }
+        old_event_ids = {event.id for event in self.old_events}
+
         for product in self.products:
             # current event
-            if DesignVariation.objects.filter(product=product, design__event=self.event).exists():
+            if (product.id, self.event.id) in design_events:
                 help_text = None
-                try:
-                    initial = Price.objects.get(
-                        product=product,
-                        valid_at=self.event,
-                        valid_for_products_from_event=self.event,
-                    ).amount
-                except Price.DoesNotExist:
-                    initial = None
+                initial = self.prices.get((product.id, self.event.id))
+                if initial is None:
                     help_text = "not set"
 
                 key = self._get_key(self.event.id, product)
@@ -419,15 +427,14 @@ class EventPricesForm(forms.Form):
             else:
                 self.current_products_keys.append(None)
             # old events
-            if DesignVariation.objects.filter(
-                product=product, design__event__in=self.old_events
-            ).exists():
-                prices = Price.objects.filter(
-                    product=product,
-                    valid_at=self.event,
-                    valid_for_products_from_event__in=self.old_events,
-                ).aggregate(min=Min("amount"), max=Max("amount"))
-                min_amount, max_amount = prices["min"], prices["max"]
+            if any((product.id, event_id) in design_events for event_id in old_event_ids):
+                old_amounts = [
+                    amount
+                    for (product_id, from_event_id), amount in self.prices.items()
+                    if product_id == product.id and from_event_id in old_event_ids
+                ]
+                min_amount = min(old_amounts, default=None)
+                max_amount = max(old_amounts, default=None)
                 initial = None
                 help_text = "not set"
                 if min_amount is not None and min_amount == max_amount:
@@ -454,36 +461,48 @@ class EventPricesForm(forms.Form):
             )
 
     def save(self):
-        created_count, changed_count = 0, 0
+        """
+        Write all new and changed prices with a single upsert.
+        """
+        amounts = {}
         for product, current_key, old_key in zip(
             self.products, self.current_products_keys, self.old_products_keys
         ):
             if current_key and (amount := self.cleaned_data[current_key]) is not None:
-                price, created = Price.objects.get_or_create(
-                    product=product,
+                amounts[product.id, self.event.id] = amount
+            if old_key and (amount := self.cleaned_data[old_key]) is not None:
+                for old_event in self.old_events:
+                    amounts[product.id, old_event.id] = amount
+
+        created_count, changed_count = 0, 0
+        prices = []
+        for (product_id, from_event_id), amount in amounts.items():
+            old_amount = self.prices.get((product_id, from_event_id))
+            if old_amount is None:
+                created_count += 1
+            elif old_amount != amount:
+                changed_count += 1
+            else:
+                continue
+            prices.append(
+                Price(
+                    product_id=product_id,
                     valid_at=self.event,
-                    valid_for_products_from_event=self.event,
-                    defaults={"amount": amount},
+                    valid_for_products_from_event_id=from_event_id,
+                    amount=amount,
                 )
-                created_count += created
-                if not created and price.amount != amount:
-                    changed_count += 1
-                    price.amount = amount
-                    price.save(update_fields=["amount"])
+            )
 
-            if old_key and (amount := self.cleaned_data[old_key]) is not None:
-                for old_event in self.old_events:
-                    price, created = Price.objects.get_or_create(
-                        product=product,
-                        valid_at=self.event,
-                        valid_for_products_from_event=old_event,
-                        defaults={"amount": amount},
-                    )
-                    created_count += created
-                    if not created and price.amount != amount:
-                        changed_count += 1
-                        price.amount = amount
-                        price.save(update_fields=["amount"])
+        if prices:
+            Price.objects.bulk_create(
+                prices,
+                update_conflicts=True,
+                unique_fields=["product", "valid_for_products_from_event", "valid_at"],
+                update_fields=["amount"],
+                batch_size=500,
+            )
+            # bulk_create skips the post_save receivers of Price
+            transaction.on_commit(invalidate_dashboard_snapshot)
         return created_count, changed_count
 
 
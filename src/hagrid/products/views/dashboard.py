@@ -1,7 +1,10 @@
 import asyncio
+import time
+from collections import defaultdict
 from typing import Any
 
 from asgiref.sync import sync_to_async
+from django.core.cache import cache
 from django.db.models import Max, Min
 from django.shortcuts import render
 from django.template.loader import render_to_string
@@ -19,41 +22,54 @@ from hagrid.products.models import (
     StoreSettings,
 )
 
+DASHBOARD_SNAPSHOT_KEY = "dashboard-snapshot"
+DASHBOARD_SNAPSHOT_VERSION_KEY = "dashboard-snapshot-version"
+DASHBOARD_AVAILABILITY_KEY = "dashboard-availability"
+DASHBOARD_SNAPSHOT_TIMEOUT = 60 * 60
+
 
 class DashboardTable:
-    def __init__(self, title, design_variations, product, price):
+    """
+    Plain, picklable data for one product on the dashboard, so that whole
+    dashboard snapshots can be stored in the cache.
+    """
+
+    def __init__(self, title, sizes, design_variations, price, images, variations):
         self.title = title
         self.price = price
-        self.design_variations = design_variations
-        self.size_scale = product.size_scale
-        self._sizes = list(self.size_scale.sizes.all())
+        self.design_variation_ids = [design_variation.pk for design_variation in design_variations]
+        self.size_labels = [size.name for size in sizes]
         self.image = None
-        self.image_count_more = 0
+        if images:
+            self.image = {"url": images[0].image.url, "alt_text": images[0].alt_text}
+        self.image_count_more = max(0, len(images) - 1)
 
-    async def fetch_images(self):
-        images = GalleryImage.objects.filter(design_variation__in=self.design_variations)
-        self.image = await images.afirst()
-        self.image_count_more = max(0, await images.acount() - 1)
+        self.rows = []
+        for design_variation in design_variations:
+            size_mapping = {size.pk: None for size in sizes}
+            for size_variation in design_variation.size_variations.all():
+                variation = {
+                    "id": size_variation.pk,
+                    "design_variation": str(design_variation),
+                    "size": {"name": size_variation.size.name},
+                    "availability": size_variation.availability,
+                }
+                size_mapping[size_variation.size_id] = variation
+                variations[size_variation.pk] = variation
+            self.rows.append((str(design_variation), [size_mapping[size.pk] for size in sizes]))
 
     def iterate_size_label(self):
-        for size in self._sizes:
-            yield size.name
+        yield from self.size_labels
 
     def get_gallery_url(self):
-        query = "&".join([
-            f"d={design_variation.pk}" for design_variation in self.design_variations
-        ])
+        query = "&".join([f"d={pk}" for pk in self.design_variation_ids])
         return f"{reverse('gallery')}?{query}"
 
     def iterate_rows(self):
         """
         Yield tuples of product name, price, size availabilities
         """
-        for design_variation in self.design_variations:
-            size_mapping = {s: None for s in self._sizes}
-            for size_variation in design_variation.size_variations.all():
-                size_mapping[size_variation.size] = size_variation
-            yield str(design_variation), [size_mapping[size] for size in self._sizes]
+        yield from self.rows
 
 
 def _open_status():
@@ -109,23 +125,7 @@ async def dashboard(request):
 
     sections = []
     if open_status is not None:
-        current_event = open_status.event
-        tables = await built_product_tables(current_event, [current_event])
-        sections.append({"title": current_event.name, "tables": tables, "description": ""})
-        other_events = [
-            e
-            async for e in open_status.selling_items_from.exclude(id=current_event.id).values_list(
-                "id", flat=True
-            )
-        ]
-        if other_events and (
-            other_event_tables := await built_product_tables(current_event, other_events)
-        ):
-            sections.append({
-                "title": "Previous Events",
-                "tables": other_event_tables,
-                "description": "",
-            })
+        sections = await get_dashboard_sections(open_status)
 
     context = {
         "sections": sections,
@@ -135,49 +135,145 @@ async def dashboard(request):
     return await sync_to_async(lambda: render(request, "dashboard/dashboard.html", context))()
 
 
-async def built_product_tables(current_event: Event, events: list[Any]) -> list[Any]:
-    async def _produce_table(product):
-        design_variations = (
-            DesignVariation.objects
-            .filter(
-                product=product,
-                design__event__in=events,
-            )
-            .select_related("product__size_scale", "design__event")
-            .prefetch_related(
-                "size_variations__size",
-            )
-            .order_by("product__position")
-        )
-        if not [_ async for _ in design_variations]:
-            return None
-        price = await Price.objects.filter(
-            valid_at=current_event,
-            valid_for_products_from_event__in=events,
-            product=product,
-        ).aaggregate(
-            min_price=Min("amount"),
-            max_price=Max("amount"),
+def dashboard_availability_key(version: int, variation_id: int) -> str:
+    return f"{DASHBOARD_AVAILABILITY_KEY}-{version}-{variation_id}"
+
+
+async def get_dashboard_snapshot_version() -> int:
+    version = await cache.aget(DASHBOARD_SNAPSHOT_VERSION_KEY)
+    if version is None:
+        # start from the time, so an evicted version never resurrects old snapshots
+        await cache.aadd(DASHBOARD_SNAPSHOT_VERSION_KEY, time.time_ns(), None)
+        version = await cache.aget(DASHBOARD_SNAPSHOT_VERSION_KEY)
+    return version
+
+
+async def get_dashboard_sections(open_status: OpenStatus) -> list[Any]:
+    """
+    The dashboard sections from the snapshot of the current version, with
+    the availabilities patched since the snapshot was built applied.
+    A snapshot built while the version is bumped is stored under the old
+    version and never read.
+    """
+    version = await get_dashboard_snapshot_version()
+    snapshot_key = f"{DASHBOARD_SNAPSHOT_KEY}-{version}"
+    snapshot = await cache.aget(snapshot_key)
+    if snapshot is None or snapshot["open_status_id"] != open_status.pk:
+        snapshot = await sync_to_async(build_dashboard_snapshot)(open_status)
+        await cache.aset(snapshot_key, snapshot, DASHBOARD_SNAPSHOT_TIMEOUT)
+
+    variations = {
+        dashboard_availability_key(version, variation_id): variation
+        for variation_id, variation in snapshot["variations"].items()
+    }
+    for key, availability in (await cache.aget_many(variations)).items():
+        variations[key]["availability"] = availability
+    return snapshot["sections"]
+
+
+def build_dashboard_snapshot(open_status: OpenStatus) -> dict[str, Any]:
+    """
+    Build all dashboard sections for an open status in a constant number of
+    queries, independent of the number of products.
+    """
+    current_event = open_status.event
+    products = list(
+        Product.objects.select_related("size_scale").prefetch_related("size_scale__sizes").all()
+    )
+    variations = {}
+
+    sections = [
+        {
+            "title": current_event.name,
+            "tables": built_product_tables(current_event, [current_event.id], products, variations),
+            "description": "",
+        }
+    ]
+    other_events = list(
+        open_status.selling_items_from.exclude(id=current_event.id).values_list("id", flat=True)
+    )
+    if other_events and (
+        other_event_tables := built_product_tables(
+            current_event, other_events, products, variations
         )
-        table = DashboardTable(
+    ):
+        sections.append({
+            "title": "Previous Events",
+            "tables": other_event_tables,
+            "description": "",
+        })
+
+    return {
+        "open_status_id": open_status.pk,
+        "sections": sections,
+        # the variation dicts are shared with the tables, so updating one here updates the table
+        "variations": variations,
+    }
+
+
+def built_product_tables(
+    current_event: Event, events: list[Any], products: list[Product], variations: dict[int, Any]
+) -> list[DashboardTable]:
+    design_variations_by_product = defaultdict(list)
+    for design_variation in (
+        DesignVariation.objects
+        .filter(design__event__in=events)
+        .select_related("product", "design__event")
+        .prefetch_related("size_variations__size")
+        .order_by("product__position", "pk")
+    ):
+        design_variations_by_product[design_variation.product_id].append(design_variation)
+
+    prices = {
+        price["product"]: {"min_price": price["min_price"], "max_price": price["max_price"]}
+        for price in Price.objects
+        .filter(valid_at=current_event, valid_for_products_from_event__in=events)
+        .values("product")
+        .annotate(min_price=Min("amount"), max_price=Max("amount"))
+    }
+
+    images_by_product = defaultdict(list)
+    for image in (
+        GalleryImage.objects
+        .filter(design_variation__design__event__in=events)
+        .select_related("design_variation")
+        .order_by("pk")
+    ):
+        images_by_product[image.design_variation.product_id].append(image)
+
+    return [
+        DashboardTable(
             title=product.name,
-            product=product,
-            price=price,
-            design_variations=design_variations,
-        )
-        await table.fetch_images()
-        return table
-
-    # gather tables and filter out None
-    return list(
-        filter(
-            bool,
-            await asyncio.gather(*[
-                _produce_table(p)
-                async for p in Product.objects
-                .select_related("size_scale")
-                .prefetch_related("size_scale__sizes")
-                .all()
-            ]),
+            sizes=list(product.size_scale.sizes.all()),
+            design_variations=design_variations_by_product[product.pk],
+            price=prices.get(product.pk, {"min_price": None, "max_price": None}),
+            images=images_by_product[product.pk],
+            variations=variations,
         )
+        for product in products
+        if design_variations_by_product[product.pk]
+    ]
+
+
+def invalidate_dashboard_snapshot():
+    try:
+        cache.incr(DASHBOARD_SNAPSHOT_VERSION_KEY)
+    except ValueError:
+        pass  # without a version there is no snapshot either
+
+
+def update_dashboard_snapshot_availabilities(availabilities: dict[int, str]):
+    """
+    Store the availabilities under their own keys of the current snapshot
+    version, so concurrent updates never overwrite each other.
+    """
+    version = cache.get(DASHBOARD_SNAPSHOT_VERSION_KEY)
+    if version is None:
+        return
+    cache.set_many(
+        {
+            dashboard_availability_key(version, variation_id): availability
+            for variation_id, availability in availabilities.items()
+        },
+        DASHBOARD_SNAPSHOT_TIMEOUT,
     )
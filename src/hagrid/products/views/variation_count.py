@@ -1,17 +1,18 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 from django import forms
 from django.contrib import messages
 from django.contrib.auth.views import login_required
+from django.db import transaction
 from django.db.models import Q
 from django.http.response import Http404
 from django.shortcuts import get_object_or_404, redirect, render, reverse
 from django.utils import timezone
 from django.views.decorators.http import require_GET, require_http_methods
 
-from hagrid.operations.models import EventTime
+from hagrid.operations.models import Event, EventTime
+from hagrid.products.count_queue import CountPriorities, refresh_count_priorities
 from hagrid.products.models import (
-    AvailabilityEvent,
     CountAccessCode,
     CountEvent,
     Product,
@@ -73,21 +74,10 @@ def variation_count(request, code, variation_id=None):
         if not variation_id:
             form = forms.Form(request.POST or None)
             event = get_current_open_status().event
-            event_time = EventTime(event)
-
-            priorities = []
-            available_variations = access_code.variations.filter(
-                ~Q(count=0)
-                & (
-                    Q(count_reserved_until__isnull=True)
-                    | Q(count_reserved_until__lt=timezone.now())
-                )
-                & (
-                    Q(count_disabled_until__isnull=True)
-                    | Q(count_disabled_until__lt=timezone.now())
-                )
-            )
-            if not available_variations:
+            refresh_count_priorities(EventTime.for_event(event))
+
+            queue = access_code.queue
+            if not queue.exists():
                 messages.add_message(
                     request,
                     messages.INFO,
@@ -95,32 +85,25 @@ def variation_count(request, code, variation_id=None):
                 )
                 return redirect("dashboard")
             else:
-                for variation in available_variations:
-                    priorities.append({
-                        "variation": variation,
-                        **variation.get_count_priority(event_time),
-                    })
-
-                priorities = sorted(priorities, key=lambda s: s["total"], reverse=True)
-
                 if request.POST and form.is_valid():
-                    top_prio = priorities[0]
-                    variation = top_prio["variation"]
-                    variation.count_reserved_until = timezone.now() + timedelta(minutes=15)
-                    variation.save()
+                    if (variation := access_code.claim_next_variation()) is None:
+                        messages.add_message(
+                            request,
+                            messages.INFO,
+                            "Nothing to count at the moment, please come back later.",
+                        )
+                        return redirect("dashboard")
 
                     # assign a variation and redirect
                     return redirect("variation_count", code, variation.id)
 
-                important = sum((int(p["total"] >= 0.5) for p in priorities), 0)
-
                 return render(
                     request,
                     "counting/variation_count_queue.html",
                     {
                         "form": form,
-                        "total_variations": len(priorities),
-                        "high_prio_variations": important,
+                        "total_variations": queue.count(),
+                        "high_prio_variations": queue.filter(count_priority__gte=0.5).count(),
                     },
                 )
 
@@ -202,41 +185,38 @@ def variation_count(request, code, variation_id=None):
             total = 0
             items_changed = 0
 
-            for item in items:
-                form = item["form"]
-                variation = item["variation"]
-                count = form.cleaned_data["count"]
-                if count is not None:
-                    variation.count = count
-                    variation.count_reserved_until = None
-                    variation.count_disabled_until = None
-                    variation.count_disabled_reason = None
-                    variation.counted_at = now
-                    variation.count_prio_bumped = False
-                    variation.save()
-                    total += count
-                    items_changed += 1
-
-                    CountEvent(
-                        count=count,
-                        variation=variation,
-                        comment=common_form.cleaned_data["comment"],
-                    ).save()
-                old_availability = variation.availability
-                new_availability = form.cleaned_data["availability"]
-                availability_information_available = (
-                    new_availability != "automatic" or count is not None
-                )
-                if new_availability != old_availability and availability_information_available:
-                    if new_availability == "automatic":
-                        new_availability = variation.computed_availability
-                    variation.availability = new_availability
-                    variation.save()
-                    AvailabilityEvent(
-                        old_state=old_availability,
-                        new_state=new_availability,
-                        variation=variation,
-                    ).save()
+            # availability transitions are recorded and broadcast once on commit
+            with transaction.atomic():
+                for item in items:
+                    form = item["form"]
+                    variation = item["variation"]
+                    count = form.cleaned_data["count"]
+                    if count is not None:
+                        variation.count = count
+                        variation.count_reserved_until = None
+                        variation.count_disabled_until = None
+                        variation.count_disabled_reason = None
+                        variation.counted_at = now
+                        variation.count_prio_bumped = False
+                        variation.save()
+                        total += count
+                        items_changed += 1
+
+                        CountEvent(
+                            count=count,
+                            variation=variation,
+                            comment=common_form.cleaned_data["comment"],
+                        ).save()
+                    old_availability = variation.availability
+                    new_availability = form.cleaned_data["availability"]
+                    availability_information_available = (
+                        new_availability != "automatic" or count is not None
+                    )
+                    if new_availability != old_availability and availability_information_available:
+                        if new_availability == "automatic":
+                            new_availability = variation.computed_availability
+                        variation.availability = new_availability
+                        variation.save()
             if access_code.as_queue:
                 messages.add_message(
                     request,
@@ -311,10 +291,13 @@ def variation_count_overview(request):
     if not (os := get_current_open_status()):
         raise Http404("Must first configure open status")
     event = os.event
-    event_time = EventTime(event)
+    event_time = EventTime.for_event(event)
+
+    variations = list(SizeVariation.objects.all())
+    count_priorities = CountPriorities.for_variations(event_time, variations)
 
     priorities = []
-    for variation in SizeVariation.objects.all():
+    for index, variation in enumerate(variations):
         prefix = f"variation-{variation.id}"
         form = (
             VariationBumpForm(request.POST, prefix=prefix)
@@ -324,7 +307,7 @@ def variation_count_overview(request):
 
         priorities.append({
             "variation": variation,
-            **variation.get_count_priority(event_time),
+            **count_priorities[index],
             "form": form,
         })
 
@@ -353,22 +336,70 @@ def variation_count_overview(request):
     return render(request, "counting/variation_count_overview.html", context)
 
 
+class CountLogFilterForm(forms.Form):
+    product = forms.ModelChoiceField(Product.objects.all(), required=False)
+    event = forms.ModelChoiceField(Event.objects.all(), required=False)
+    access_code = forms.ModelChoiceField(
+        CountAccessCode.objects.prefetch_related("products", "events"), required=False
+    )
+
+    def filter(self, events):
+        if not self.is_valid():
+            return events
+        if product := self.cleaned_data["product"]:
+            events = events.filter(variation__design_variation__product=product)
+        if event := self.cleaned_data["event"]:
+            events = events.filter(variation__design_variation__design__event=event)
+        if access_code := self.cleaned_data["access_code"]:
+            events = events.filter(variation__in=access_code.variations)
+        return events
+
+
+COUNT_LOG_PAGE_SIZE = 100
+
+
 @login_required()
 @require_GET
 def variation_count_log(request):
     if not (os := get_current_open_status()):
         raise Http404("Must first configure open status")
     event = os.event
-    event_time = EventTime(event)
+    event_time = EventTime.for_event(event)
     now = event_time.datetime_to_event_time(timezone.now())
-    events = CountEvent.objects.order_by("-datetime").all()
+
+    filter_form = CountLogFilterForm(request.GET)
+    events = filter_form.filter(CountEvent.objects.all()).select_related(
+        "variation__design_variation__product",
+        "variation__design_variation__design__event",
+        "variation__size",
+    )
+
+    # keyset pagination, the cursor is the (datetime, id) of the last event shown
+    cursor = request.GET.get("cursor")
+    if cursor:
+        try:
+            cursor_datetime, cursor_id = cursor.rsplit("_", 1)
+            cursor_datetime = datetime.fromisoformat(cursor_datetime)
+            events = events.filter(
+                Q(datetime__lt=cursor_datetime) | Q(datetime=cursor_datetime, id__lt=int(cursor_id))
+            )
+        except ValueError as _e:
+            raise Http404()
+
+    events = list(events.order_by("-datetime", "-id")[: COUNT_LOG_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(events) > COUNT_LOG_PAGE_SIZE:
+        events = events[:COUNT_LOG_PAGE_SIZE]
+        next_cursor = f"{events[-1].datetime.isoformat()}_{events[-1].id}"
+
+    ages = now - event_time.timestamps_to_event_times([
+        event.datetime.timestamp() for event in events
+    ])
     context = {
-        "items": [
-            {
-                "event": event,
-                "age": now - event_time.datetime_to_event_time(event.datetime),
-            }
-            for event in events
-        ]
+        "items": [{"event": event, "age": age} for event, age in zip(events, ages.tolist())],
+        "next_cursor": next_cursor,
+        "filter_form": filter_form,
     }
+    if request.htmx and cursor:
+        return render(request, "counting/variation_count_log_rows.html", context)
     return render(request, "counting/variation_count_log.html", context)
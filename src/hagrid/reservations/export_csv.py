@@ -3,36 +3,51 @@ import io
 import logging
 
 from ..products.models import SizeVariation
+from ..products.prices import PriceResolver
+from ..utils import Echo
 from .models import Reservation
 
 logger = logging.getLogger(__name__)
 
+HEADER = [
+    "event",
+    "team name",
+    "state",
+    "contact name",
+    "part name",
+    "position and number",
+    "price",
+    "item",
+]
 
-def write_reservation(reservation: Reservation, writer):
-    writer.writerow([
-        "event",
-        "team name",
-        "state",
-        "contact name",
-        "part name",
-        "position and number",
-        "price",
-        "item",
-    ])
+
+def reservation_rows(reservation: Reservation, price_resolver: PriceResolver):
+    """
+    The rows of a reservation, one per unit of every position. The parts,
+    positions and variations should be prefetched, see with_prices().
+    """
+    event = str(reservation.event)
     for part in reservation.parts.all():
         for position in part.positions.all():
             variation: SizeVariation = position.variation
+            price = str(price_resolver.get(variation))
+            item = str(variation)
             for i in range(position.amount):
-                writer.writerow([
-                    str(reservation.event),
+                yield [
+                    event,
                     str(reservation.team_name),
                     str(reservation.state),
                     str(reservation.contact_name),
                     str(part.title),
                     str(position.id) + "-" + str(i),
-                    str(variation.get_price_at(reservation.event)),
-                    str(variation),
-                ])
+                    price,
+                    item,
+                ]
+
+
+def write_reservation(reservation: Reservation, writer, price_resolver: PriceResolver):
+    writer.writerow(HEADER)
+    writer.writerows(reservation_rows(reservation, price_resolver))
     writer.writerow([])
 
 
@@ -47,8 +62,36 @@ def generate_reservation_csv(reservations):
     """
     data_buffer = io.StringIO()  # unfortunately the fast cStringIO isn't avaiable anymore
     writer = csv.writer(data_buffer)
+    # prices at the event of the reservation, loaded once per event
+    price_resolvers = {}
     for reservation in reservations:
-        write_reservation(reservation, writer)
+        if reservation.event_id not in price_resolvers:
+            price_resolvers[reservation.event_id] = PriceResolver(reservation.event)
+        write_reservation(reservation, writer, price_resolvers[reservation.event_id])
     data_bytes = data_buffer.getvalue()
     data_buffer.close()
     return data_bytes
+
+
+def stream_event_reservations_csv(event, chunk_size=100):
+    """
+    Yield all reservations of an event as csv, with a single header and a
+    chunk of lines per reservation. Reservations are loaded and prefetched
+    chunk_size at a time, so memory doesn't grow with the size of the event.
+    """
+    price_resolver = PriceResolver(event)
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    reservations = (
+        Reservation.objects
+        .filter(event=event)
+        .select_related("event")
+        .with_prices()
+        .order_by("id")
+        .iterator(chunk_size=chunk_size)
+    )
+    for reservation in reservations:
+        if lines := "".join(
+            writer.writerow(row) for row in reservation_rows(reservation, price_resolver)
+        ):
+            yield lines
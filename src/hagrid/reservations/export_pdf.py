@@ -1,9 +1,14 @@
+import itertools
 import logging
-from collections import Counter
+import os
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 
+import django
 import qrcode
 from django.conf import settings
+from django.db import connections
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
@@ -15,6 +20,8 @@ from reportlab.pdfgen import canvas
 from reportlab.platypus import Paragraph
 
 from ..products.models import SizeVariation
+from ..products.prices import PriceResolver
+from ..products.qr_codes import draw_qr_code
 from .models import Reservation
 
 logger = logging.getLogger(__name__)
@@ -46,12 +53,22 @@ class Document:
     cursor_x = 0
     ready = False
 
-    def __init__(self, filename: str, title: str, author: str, subject: str, side_label=""):
+    def __init__(
+        self,
+        filename: str,
+        title: str,
+        author: str,
+        subject: str,
+        side_label="",
+        compress=True,
+    ):
         self.page = 0
         self.ready = False
         self.watermark = ""
         self.bytes_buffer = BytesIO()
-        self.canvas = canvas.Canvas(self.bytes_buffer, pagesize=A4, pageCompression=0)
+        self.canvas = canvas.Canvas(
+            self.bytes_buffer, pagesize=A4, pageCompression=1 if compress else 0
+        )
         self.canvas.setTitle(title)
         self.w, self.h = A4
         self.canvas.setAuthor(author)
@@ -107,6 +124,23 @@ class Document:
         )
         self.canvas.setFillColorRGB(255, 255, 255, alpha=1.0)
 
+    def draw_template(self, name: str, width, height, draw):
+        """
+        Draw a template with its upper left corner at the cursor. On first use,
+        draw(canvas, width) renders it into a form XObject, with y going down
+        from 0 to -height, every use after that only references the form.
+        """
+        name = f"{name}-{width:.2f}"
+        if not self.canvas.hasForm(name):
+            # leave room for the line width around the bounding box
+            self.canvas.beginForm(name, lowerx=-1, lowery=-height - 1, upperx=width + 1, uppery=1)
+            draw(self.canvas, width)
+            self.canvas.endForm()
+        self.canvas.saveState()
+        self.canvas.translate(self.cursor_x, self.cursor_y)
+        self.canvas.doForm(name)
+        self.canvas.restoreState()
+
     def wrap_up(self):
         self.canvas.showPage()
         self.canvas.save()
@@ -125,18 +159,6 @@ def timestamp(filestr=True):
         return timestring
 
 
-def generate_qr_code(link: str):
-    qr = qrcode.QRCode(
-        version=None,
-        error_correction=qrcode.constants.ERROR_CORRECT_H,
-        box_size=30,
-        border=4,
-    )
-    qr.add_data(link)
-    qr.make(fit=True)
-    return qr.make_image()
-
-
 def generate_collection_list(reservation: Reservation, distinct_required=False):
     groups = []
     titles = []
@@ -191,13 +213,18 @@ def render_invoice_header(r: Reservation, d: Document):
     d.cursor_y -= textheight + 20
 
     # Render QR Code next to the comment
-    i = generate_qr_code(
+    draw_qr_code(
+        d.canvas,
         "{}{}".format(
             settings.SITE_URL,
             reverse("actionsetpacked", args=[r.secret, r.action_secret]),
-        )
+        ),
+        d.w - 150,
+        d.h - 175,
+        125,
+        error_correction=qrcode.constants.ERROR_CORRECT_H,
+        box_size=30,
     )
-    d.canvas.drawInlineImage(i, d.w - 150, d.h - 175, 125, 125)
 
     # Render Contact info below comment if short
     # Render below QR code if comment is long
@@ -223,83 +250,72 @@ def render_invoice_header(r: Reservation, d: Document):
     d.canvas.setFont("Helvetica", 11)
 
 
+def draw_collection_table_header(c: canvas.Canvas, width):
+    c.line(0, 0, width, 0)
+    c.line(0, 0, 0, -15)
+    c.line(width, 0, width, -15)
+    c.line(0, -15, width, -15)
+
+    c.setFillColor(black)
+    c.setFont("Helvetica", 11)
+    c.drawString(10, -10, "Article")
+    c.drawString(310, -10, "Quantity")
+    # c.drawString(290, -10, "Notes?")
+    c.drawString(width - 36, -10, "C1")
+    c.drawString(width - 16, -10, "C2")
+
+    c.line(5, 0, 5, -15)
+    c.line(305, 0, 305, -15)
+    # c.line(285, 0, 285, -15)
+    c.line(width - 18, 0, width - 18, -15)
+    c.line(width - 38, 0, width - 38, -15)
+
+
+def draw_collection_list_row(c: canvas.Canvas, width):
+    # Draw table boxes
+    c.line(0, 0, width, 0)
+    c.line(0, 0, 0, -15)
+    c.line(width, 0, width, -15)
+    c.line(0, -15, width, -15)
+
+    # Draw table separation lines
+    c.line(5, 0, 5, -15)
+    c.line(305, 0, 305, -15)
+    # c.line(285, 0, 285, -15)
+    c.line(width - 18, 0, width - 18, -15)
+    c.line(width - 38, 0, width - 38, -15)
+
+    # Draw hollow rect for package checking
+    for i in range(2):
+        c.line(width - 2 - i * 20, -2, width - 2 - i * 20, -13)
+        c.line(width - 13 - i * 20, -2, width - 13 - i * 20, -13)
+        c.line(width - 13 - i * 20, -2, width - 2 - i * 20, -2)
+        c.line(width - 13 - i * 20, -13, width - 2 - i * 20, -13)
+
+
 def render_collection_table_header(d: Document, title: str):
     d.canvas.setFillColor(black)
     d.canvas.setFont("Helvetica", 11)
     d.canvas.drawString(d.cursor_x, d.cursor_y - 5, title)
     d.cursor_y -= 15
 
-    d.canvas.line(d.cursor_x, d.cursor_y, d.w - d.right_inset, d.cursor_y)
-    d.canvas.line(d.cursor_x, d.cursor_y, d.cursor_x, d.cursor_y - 15)
-    d.canvas.line(d.w - d.right_inset, d.cursor_y, d.w - d.right_inset, d.cursor_y - 15)
-    d.canvas.line(d.cursor_x, d.cursor_y - 15, d.w - d.right_inset, d.cursor_y - 15)
-
-    d.canvas.drawString(d.cursor_x + 10, d.cursor_y - 10, "Article")
-    d.canvas.drawString(d.cursor_x + 310, d.cursor_y - 10, "Quantity")
-    # d.canvas.drawString(d.cursor_x + 290, d.cursor_y - 10, "Notes?")
-    d.canvas.drawString(A4[0] - 81, d.cursor_y - 10, "C1")
-    d.canvas.drawString(A4[0] - 61, d.cursor_y - 10, "C2")
-
-    d.canvas.line(d.cursor_x + 5, d.cursor_y, d.cursor_x + 5, d.cursor_y - 15)
-    d.canvas.line(d.cursor_x + 305, d.cursor_y, d.cursor_x + 305, d.cursor_y - 15)
-    # d.canvas.line(d.cursor_x + 285, d.cursor_y, d.cursor_x + 285, d.cursor_y - 15)
-    d.canvas.line(d.w - d.right_inset - 18, d.cursor_y, d.w - d.right_inset - 18, d.cursor_y - 15)
-    d.canvas.line(
-        (d.w - d.right_inset) - 38,
-        d.cursor_y,
-        (d.w - d.right_inset) - 38,
-        d.cursor_y - 15,
+    d.draw_template(
+        "collection-header",
+        d.w - d.right_inset - d.cursor_x,
+        15,
+        draw_collection_table_header,
     )
-
     d.cursor_y -= 15
 
 
 def render_collection_list_entry(pos: SizeVariation, amount: int, d: Document):
-    # Draw table boxes
-    d.canvas.line(d.cursor_x, d.cursor_y, d.w - d.right_inset, d.cursor_y)
-    d.canvas.line(d.cursor_x, d.cursor_y, d.cursor_x, d.cursor_y - 15)
-    d.canvas.line(d.w - d.right_inset, d.cursor_y, d.w - d.right_inset, d.cursor_y - 15)
-    d.canvas.line(d.cursor_x, d.cursor_y - 15, d.w - d.right_inset, d.cursor_y - 15)
-
-    # Draw table separation lines
-    d.canvas.line(d.cursor_x + 5, d.cursor_y, d.cursor_x + 5, d.cursor_y - 15)
-    d.canvas.line(d.cursor_x + 305, d.cursor_y, d.cursor_x + 305, d.cursor_y - 15)
-    # d.canvas.line(d.cursor_x + 285, d.cursor_y, d.cursor_x + 285, d.cursor_y - 15)
-    d.canvas.line(d.w - d.right_inset - 18, d.cursor_y, d.w - d.right_inset - 18, d.cursor_y - 15)
-    d.canvas.line(
-        (d.w - d.right_inset) - 38,
-        d.cursor_y,
-        (d.w - d.right_inset) - 38,
-        d.cursor_y - 15,
+    d.draw_template(
+        "collection-row",
+        d.w - d.right_inset - d.cursor_x,
+        15,
+        draw_collection_list_row,
     )
 
-    # Draw hollow rect for package checking
-    for i in range(2):
-        d.canvas.line(
-            (d.w - d.right_inset - 2) - i * 20,
-            d.cursor_y - 2,
-            (d.w - d.right_inset - 2) - i * 20,
-            d.cursor_y - 13,
-        )
-        d.canvas.line(
-            (d.w - d.right_inset - 13) - i * 20,
-            d.cursor_y - 2,
-            (d.w - d.right_inset - 13) - i * 20,
-            d.cursor_y - 13,
-        )
-        d.canvas.line(
-            (d.w - d.right_inset - 13) - i * 20,
-            d.cursor_y - 2,
-            (d.w - d.right_inset - 2) - i * 20,
-            d.cursor_y - 2,
-        )
-        d.canvas.line(
-            (d.w - d.right_inset - 13) - i * 20,
-            d.cursor_y - 13,
-            (d.w - d.right_inset - 2) - i * 20,
-            d.cursor_y - 13,
-        )
-
     d.canvas.drawString(d.cursor_x + 10, d.cursor_y - 13, str(pos))
     d.canvas.drawString(
         d.cursor_x + 460 - d.get_text_width(str(amount), text_size=11), d.cursor_y - 10, str(amount)
@@ -318,6 +334,19 @@ def render_collection_list(l, d: Document, title: str = "packing list:"):
     d.cursor_y -= 15
 
 
+def draw_settlement_header(c: canvas.Canvas, width):
+    c.line(0, 0, 0, -15)
+    c.line(width, 0, width, -15)
+    c.line(0, 0, width, 0)
+    c.line(0, -15, width, -15)
+    c.setFillColor(black)
+    c.setFont("Helvetica", 11)
+    c.drawString(5, -10, "Amount")
+    c.drawString(55, -10, "Article")
+    c.drawString(205, -10, "Single Item price")
+    c.drawString(width - 130, -10, "Sum")
+
+
 def render_settlement_head(d: Document):
     d.canvas.setFont("Helvetica", 11)
     d.canvas.setFillColor(black)
@@ -328,20 +357,12 @@ def render_settlement_head(d: Document):
     d.cursor_y -= 20
 
     # Render table head
-    p = d.canvas
-    p.line(45, d.cursor_y, 45, d.cursor_y - 15)
-    p.line(d.w - 45, d.cursor_y, d.w - 45, d.cursor_y - 15)
-    p.line(45, d.cursor_y, d.w - 45, d.cursor_y)
-    p.line(45, d.cursor_y - 15, d.w - 45, d.cursor_y - 15)
-    p.drawString(50, d.cursor_y - 10, "Amount")
-    p.drawString(100, d.cursor_y - 10, "Article")
-    p.drawString(250, d.cursor_y - 10, "Single Item price")
-    p.drawString(d.w - 175, d.cursor_y - 10, "Sum")
+    d.draw_template("settlement-header", d.w - 2 * d.cursor_x, 15, draw_settlement_header)
     d.cursor_y -= 15
     d.canvas.setFont("Helvetica", 9)
 
 
-def render_invoice_end(l, d: Document, reservation):
+def render_invoice_end(l, d: Document, price_resolver: PriceResolver):
     render_settlement_head(d)
     total = 0
     for request in l:
@@ -352,7 +373,7 @@ def render_invoice_end(l, d: Document, reservation):
             render_settlement_head(d)
         amount: int = request[1]
         a: SizeVariation = request[0]
-        price = a.get_price_at(reservation.event)
+        price = price_resolver.get(a)
         total += price * amount if price else 0
         d.canvas.line(45, d.cursor_y, 45, d.cursor_y - 15)
         d.canvas.line(d.w - 45, d.cursor_y, d.w - 45, d.cursor_y - 15)
@@ -378,7 +399,7 @@ def render_invoice_end(l, d: Document, reservation):
     d.canvas.drawString(260, d.cursor_y - 10, "Signature of person who checked")
 
 
-def render_reservation(r: Reservation, d: Document):
+def render_reservation(r: Reservation, d: Document, price_resolver: PriceResolver):
     if r.state == Reservation.STATE_SUBMITTED:
         d.set_watermark("")
     else:
@@ -395,9 +416,9 @@ def render_reservation(r: Reservation, d: Document):
         # We need to regenerate the list (this time without separation)
         # As we still want a single sum
         articles, titles = generate_collection_list(r, False)
-        render_invoice_end(articles[0], d, r)
+        render_invoice_end(articles[0], d, price_resolver)
     else:
-        render_invoice_end(articles[0], d, r)
+        render_invoice_end(articles[0], d, price_resolver)
 
 
 def get_side_stip_text(r: Reservation):
@@ -405,7 +426,7 @@ def get_side_stip_text(r: Reservation):
 
 
 def generate_packing_pdf(
-    reservations, filename: str, username="nobody", title="C3FOC - Reservations"
+    reservations, filename: str, username="nobody", title="C3FOC - Reservations", compress=True
 ):
     """
     This method turns an array of reservations into a PDF file and returns its bytes.
@@ -424,6 +445,9 @@ def generate_packing_pdf(
     title: str
         Optional. The title of the PDF being generated.
 
+    compress: bool
+        Optional. Whether to compress the page contents, defaults to True.
+
     Returns
     -------
     bytes:
@@ -438,7 +462,10 @@ def generate_packing_pdf(
         f"The robots in slavery by {username!s}.",
         f"This document, originally created at {timestamp(filestr=False)}, contains the requested reservations.",
         side_label=get_side_stip_text(reservations[0]),
+        compress=compress,
     )
+    # prices at the event of the reservation, loaded once per event
+    price_resolvers = {}
     for reservation_counter, r in enumerate(reservations):
         # Test for document appending
         if reservation_counter != 0:
@@ -446,5 +473,56 @@ def generate_packing_pdf(
             d.page = 0
             d.new_page()
 
-        render_reservation(r, d)
+        if r.event_id not in price_resolvers:
+            price_resolvers[r.event_id] = PriceResolver(r.event)
+        render_reservation(r, d, price_resolvers[r.event_id])
     return d.wrap_up()
+
+
+def setup_packing_pdf_worker():
+    # spawned workers start without Django, forked ones must not share the
+    # database connections of the parent
+    django.setup()
+    connections.close_all()
+
+
+def generate_packing_pdf_part(reservation_ids, username, title, compress):
+    reservations = Reservation.objects.with_prices().in_bulk(reservation_ids)
+    return generate_packing_pdf(
+        [reservations[reservation_id] for reservation_id in reservation_ids],
+        "",
+        username=username,
+        title=title,
+        compress=compress,
+    )
+
+
+def generate_packing_pdf_parts(
+    reservation_ids,
+    username="nobody",
+    title="C3FOC - Reservations",
+    compress=True,
+    chunk_size=25,
+    workers=None,
+):
+    """
+    Render the reservations into PDFs of at most chunk_size reservations each
+    in a pool of worker processes, and yield the bytes of the PDFs in order.
+
+    Only a few parts per worker are rendered ahead of the consumer, so memory
+    stays bounded no matter how many reservations are exported.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = (list(chunk) for chunk in itertools.batched(reservation_ids, chunk_size))
+    connections.close_all()
+    with ProcessPoolExecutor(workers, initializer=setup_packing_pdf_worker) as pool:
+
+        def submit(chunk):
+            return pool.submit(generate_packing_pdf_part, chunk, username, title, compress)
+
+        pending = deque(map(submit, itertools.islice(chunks, 2 * workers)))
+        while pending:
+            pdf = pending.popleft().result()
+            if (chunk := next(chunks, None)) is not None:
+                pending.append(submit(chunk))
+            yield pdf
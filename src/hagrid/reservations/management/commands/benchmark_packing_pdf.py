@@ -0,0 +1,53 @@
+import itertools
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from hagrid.operations.models import Event
+from hagrid.products.views.dashboard import get_current_open_status
+from hagrid.reservations.export_pdf import generate_packing_pdf
+from hagrid.reservations.models import Reservation
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the packing lists of a batch of reservations into one PDF, uncompressed and "
+        "compressed, and report render time and size. If the event has fewer reservations "
+        "than --reservations, they are repeated"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--event", type=int, help="id of the event, default is the current")
+        parser.add_argument("--reservations", type=int, default=300)
+
+    def handle(self, *args, **options):
+        if options["event"] is not None:
+            try:
+                event = Event.objects.get(pk=options["event"])
+            except Event.DoesNotExist:
+                raise CommandError("No such event") from None
+        elif open_status := get_current_open_status():
+            event = open_status.event
+        else:
+            raise CommandError("Must first configure open status or pass --event")
+
+        reservations = list(
+            Reservation.objects
+            .with_prices()
+            .filter(event=event)
+            .exclude(state=Reservation.STATE_CANCELLED)
+            .order_by("id")[: options["reservations"]]
+        )
+        if not reservations:
+            raise CommandError("No reservations to export")
+        batch = list(itertools.islice(itertools.cycle(reservations), options["reservations"]))
+
+        self.stdout.write(f"reservations: {len(batch)} ({len(reservations)} distinct)")
+        for compress in (False, True):
+            start = time.perf_counter()
+            pdf = generate_packing_pdf(batch, "benchmark", username="manage.py", compress=compress)
+            duration = time.perf_counter() - start
+            self.stdout.write(
+                f"{'compressed' if compress else 'uncompressed':<13} "
+                f"{duration:6.2f} s {len(pdf) / 1024:9.0f} KiB"
+            )
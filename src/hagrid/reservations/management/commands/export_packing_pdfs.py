@@ -0,0 +1,86 @@
+import argparse
+import itertools
+import time
+import zipfile
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import slugify
+
+from hagrid.operations.models import Event
+from hagrid.products.views.dashboard import get_current_open_status
+from hagrid.reservations.export_pdf import generate_packing_pdf_parts
+from hagrid.reservations.models import Reservation
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the packing lists of all reservations of an event in parallel worker processes, "
+        "into numbered PDFs of --chunk-size reservations each. The PDFs are written to a "
+        "directory, or into a zip file if the output ends with .zip"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", type=Path)
+        parser.add_argument("--event", type=int, help="id of the event, default is the current")
+        parser.add_argument(
+            "--state",
+            action="append",
+            choices=[state for state, _ in Reservation.STATES],
+            help="only reservations in this state, can be repeated, default is all but cancelled",
+        )
+        parser.add_argument("--chunk-size", type=int, default=25)
+        parser.add_argument("--workers", type=int, help="default is the number of CPUs")
+        parser.add_argument(
+            "--compress",
+            action=argparse.BooleanOptionalAction,
+            default=True,
+            help="compress the pages, default is on",
+        )
+
+    def handle(self, *args, **options):
+        if options["event"] is not None:
+            try:
+                event = Event.objects.get(pk=options["event"])
+            except Event.DoesNotExist:
+                raise CommandError("No such event") from None
+        elif open_status := get_current_open_status():
+            event = open_status.event
+        else:
+            raise CommandError("Must first configure open status or pass --event")
+
+        reservations = Reservation.objects.filter(event=event)
+        if options["state"]:
+            reservations = reservations.filter(state__in=options["state"])
+        else:
+            reservations = reservations.exclude(state=Reservation.STATE_CANCELLED)
+        reservation_ids = list(reservations.order_by("id").values_list("id", flat=True))
+        if not reservation_ids:
+            raise CommandError("No reservations to export")
+
+        parts = generate_packing_pdf_parts(
+            reservation_ids,
+            username="manage.py",
+            compress=options["compress"],
+            chunk_size=options["chunk_size"],
+            workers=options["workers"],
+        )
+        names = (f"packing-{slugify(event.name)}-{index:03d}.pdf" for index in itertools.count(1))
+
+        start = time.perf_counter()
+        output = options["output"]
+        if output.suffix == ".zip":
+            with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+                for name, pdf in zip(names, parts):
+                    archive.writestr(name, pdf)
+        else:
+            output.mkdir(parents=True, exist_ok=True)
+            for name, pdf in zip(names, parts):
+                (output / name).write_bytes(pdf)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Exported {len(reservation_ids)} reservations to {output} "
+                f"in {time.perf_counter() - start:.1f} s"
+            )
+        )
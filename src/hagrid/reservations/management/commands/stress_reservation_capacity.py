@@ -0,0 +1,111 @@
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import Sum
+
+from hagrid.products.models import SizeVariation
+from hagrid.products.views.dashboard import get_current_open_status
+from hagrid.reservations.models import (
+    CapacityExceeded,
+    Reservation,
+    ReservationPart,
+    ReservationPosition,
+)
+from hagrid.reservations.views.teams import ReservationPartDetailView
+
+
+class Command(BaseCommand):
+    help = (
+        "Let concurrent clients reserve a variation until it runs out, checking that no more "
+        "than amount_initial gets reserved and that amount_reserved matches the positions. "
+        "Writes temporary reservations, so only runs with DEBUG enabled"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("variation", type=int, help="id of the SizeVariation to reserve")
+        parser.add_argument("--clients", type=int, default=8)
+        parser.add_argument("--rounds", type=int, default=10)
+        parser.add_argument("--amount", type=int, default=1, help="added by every submit")
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG:
+            raise CommandError("Refusing to write test reservations without DEBUG")
+        if not (open_status := get_current_open_status()):
+            raise CommandError("Must first configure open status")
+        try:
+            variation = SizeVariation.objects.get(pk=options["variation"])
+        except SizeVariation.DoesNotExist:
+            raise CommandError("No such variation") from None
+        if variation.amount_initial is None:
+            raise CommandError("The variation has no amount_initial")
+        reserved_before = variation.amount_reserved
+        left = max(0, variation.amount_initial - reserved_before)
+
+        parts = []
+        for client in range(options["clients"]):
+            reservation = Reservation.objects.create(
+                team_name=f"stress test {client}",
+                contact_name="stress test",
+                secret=f"stress-{variation.pk}-{client}",
+                state=Reservation.STATE_EDITABLE,
+                event=open_status.event,
+            )
+            parts.append(ReservationPart.objects.create(reservation=reservation, title="stress"))
+
+        results = {"reserved": 0, "exceeded": 0, "errors": 0}
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(parts))
+
+        def client(part):
+            view = ReservationPartDetailView()
+            amount = 0
+            barrier.wait()
+            try:
+                for _ in range(options["rounds"]):
+                    try:
+                        with transaction.atomic():
+                            view.save_positions(part, {variation.pk: amount + options["amount"]})
+                        amount += options["amount"]
+                        result = "reserved"
+                    except CapacityExceeded:
+                        result = "exceeded"
+                    except OperationalError:
+                        # e.g. SQLite giving up waiting for its database lock
+                        result = "errors"
+                    with lock:
+                        results[result] += 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client, args=(part,)) for part in parts]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            variation.refresh_from_db()
+            positions = ReservationPosition.objects.filter(variation=variation)
+            total = positions.aggregate(total=Sum("amount"))["total"] or 0
+            taken = positions.filter(part__in=parts).aggregate(total=Sum("amount"))["total"] or 0
+            reserved_after = variation.amount_reserved
+        finally:
+            Reservation.objects.filter(parts__in=parts).delete()
+        variation.refresh_from_db()
+
+        self.stdout.write(f"left before:      {left}")
+        self.stdout.write(f"submits:          {results}")
+        self.stdout.write(f"reserved:         {taken}")
+        self.stdout.write(f"amount_reserved:  {reserved_after}")
+        self.stdout.write(f"sum of positions: {total}")
+        if taken > left:
+            raise CommandError(f"Oversold: reserved {taken} with only {left} left")
+        if reserved_after != total:
+            raise CommandError("amount_reserved doesn't match the positions")
+        if variation.amount_reserved != reserved_before:
+            raise CommandError("amount_reserved wasn't released with the test reservations")
+        if results["errors"]:
+            self.stdout.write(self.style.WARNING("some submits failed with database errors"))
+        self.stdout.write(self.style.SUCCESS("no oversell"))
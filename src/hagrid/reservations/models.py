@@ -1,10 +1,75 @@
 import uuid
+from collections import Counter
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Prefetch
+from django.db.models.query import ModelIterable
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils.functional import cached_property
 
 from hagrid.operations.models import Event
-from hagrid.products.models import Price, SizeVariation
-from hagrid.products.views.dashboard import get_current_open_status
+from hagrid.products.models import SizeVariation
+from hagrid.products.prices import PriceResolver
+
+
+class CapacityExceeded(Exception):
+    def __init__(self, variation_ids):
+        super().__init__(f"Not enough left of variations {variation_ids}")
+        self.variation_ids = variation_ids
+
+
+def reserve_amounts(deltas, check_capacity=True):
+    """
+    Add the amount deltas (variation id -> delta) to the reserved amounts of
+    the variations.
+
+    Every increase is a single conditional UPDATE that only matches while the
+    variation has enough left, so concurrent reservations can't take more than
+    amount_initial without locking anything but the variation's row. Raises
+    CapacityExceeded if any increase didn't fit, the caller has to roll back.
+    """
+    exceeded = []
+    # in a fixed order, so that concurrent reservations lock rows in the same order
+    for variation_id, delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        variations = SizeVariation.objects.filter(pk=variation_id)
+        if check_capacity and delta > 0:
+            variations = variations.filter(amount_reserved__lte=F("amount_initial") - delta)
+        if not variations.update(amount_reserved=F("amount_reserved") + delta):
+            exceeded.append(variation_id)
+    if exceeded:
+        raise CapacityExceeded(exceeded)
+
+
+class PricedReservationIterable(ModelIterable):
+    def __iter__(self):
+        # one price matrix for all reservations of the queryset
+        price_resolver = PriceResolver()
+        for reservation in super().__iter__():
+            reservation.price_resolver = price_resolver
+            yield reservation
+
+
+class ReservationQuerySet(models.QuerySet):
+    def with_prices(self):
+        """
+        Prefetch the parts and positions with everything needed to show them
+        and their prices.
+        """
+        queryset = self.prefetch_related(
+            Prefetch(
+                "parts__positions",
+                queryset=ReservationPosition.objects.select_related(
+                    "variation__design_variation__design__event",
+                    "variation__design_variation__product",
+                    "variation__size",
+                ),
+            )
+        )
+        queryset._iterable_class = PricedReservationIterable
+        return queryset
 
 
 class Reservation(models.Model):
@@ -47,9 +112,15 @@ class Reservation(models.Model):
     )
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name="reservations")
 
+    objects = ReservationQuerySet.as_manager()
+
     def __str__(self):
         return f"Reservation for {self.team_name} by {self.contact_name}"
 
+    @cached_property
+    def price_resolver(self):
+        return PriceResolver()
+
     @property
     def price(self):
         return sum(part.price for part in self.parts.all())
@@ -69,9 +140,13 @@ class ReservationPart(models.Model):
     def __str__(self):
         return f"Part of {self.reservation!s} titled {self.title}"
 
+    @cached_property
+    def price_resolver(self):
+        return self.reservation.price_resolver
+
     @property
     def price(self):
-        return sum(position.price for position in self.positions.all() if position.price)
+        return sum(filter(None, (position.price for position in self.positions.all())))
 
 
 class ReservationPosition(models.Model):
@@ -81,16 +156,39 @@ class ReservationPosition(models.Model):
     part = models.ForeignKey(ReservationPart, related_name="positions", on_delete=models.CASCADE)
     amount = models.PositiveSmallIntegerField(default=0)
 
+    # (variation id, amount) as booked in SizeVariation.amount_reserved
+    loaded_reservation = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_reservation = (
+            instance.__dict__.get("variation_id"),
+            instance.__dict__.get("amount"),
+        )
+        return instance
+
+    def save(self, *args, **kwargs):
+        # single saves (e.g. in the admin) are booked even beyond amount_initial,
+        # the reservation views go through reserve_amounts directly
+        deltas = Counter({self.variation_id: self.amount})
+        if self.loaded_reservation is not None:
+            variation_id, amount = self.loaded_reservation
+            deltas[variation_id] -= amount
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            reserve_amounts(deltas, check_capacity=False)
+        self.loaded_reservation = (self.variation_id, self.amount)
+
     @property
     def price(self):
-        status = get_current_open_status()
-        if not status:
+        price = self.part.price_resolver.get(self.variation)
+        if price is None:
             return None
-        price = Price.objects.filter(
-            product=self.variation.design_variation.product,
-            valid_at=status.event,
-            valid_for_products_from_event=self.variation.design_variation.design.event,
-        ).first()
-        if not price:
-            return None
-        return price.amount * self.amount
+        return price * self.amount
+
+
+@receiver(post_delete, sender=ReservationPosition, dispatch_uid="release_reserved_amount")
+def release_reserved_amount(sender, instance, **kwargs):
+    # also runs for positions deleted along with their part or reservation
+    reserve_amounts({instance.variation_id: -instance.amount})
@@ -28,6 +28,11 @@ urlpatterns = [
         administration.ReservationCSVDownloadView.as_view(),
         name="reservationcsv",
     ),
+    path(
+        "administration/csv/event/<int:event_id>/",
+        administration.EventReservationsCSVDownloadView.as_view(),
+        name="eventreservationscsv",
+    ),
     path(
         "<slug:secret>/",
         teams.ReservationDetailView.as_view(),
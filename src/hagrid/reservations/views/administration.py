@@ -5,7 +5,7 @@ from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
 from django.db.models import Sum
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.template.loader import render_to_string
 from django.utils import timezone
@@ -16,12 +16,16 @@ from django_eventstream import send_event
 
 from hagrid.operations.models import Event
 from hagrid.products.models import Product
-from hagrid.products.tables import ProductTable
+from hagrid.products.tables import ProductTableSet
 from hagrid.products.views.dashboard import get_current_open_status
 from hagrid.reservations import emails
-from hagrid.reservations.export_csv import generate_reservation_csv
+from hagrid.reservations.export_csv import (
+    generate_reservation_csv,
+    stream_event_reservations_csv,
+)
 from hagrid.reservations.export_pdf import generate_packing_pdf
 from hagrid.reservations.models import Reservation, ReservationPosition
+from hagrid.utils import iterate_in_thread
 
 
 class ReservationStatisticsView(LoginRequiredMixin, TemplateView):
@@ -46,25 +50,17 @@ class ReservationStatisticsView(LoginRequiredMixin, TemplateView):
             return f'<div class="text-center">{amount_reserved_by_variation_id.get(variation.id, 0)}</span></div>'
 
         products = Product.objects.all()
-        tables = [
-            table
-            for event_groups, label in [
+        tables = ProductTableSet(
+            products,
+            [
                 ({current_event}, current_event.name),
                 (set(Event.objects.all()) - {current_event}, "old"),
-            ]
-            for product in products
-            if (
-                table := ProductTable(
-                    title=f"{label} {product.name}",
-                    product=product,
-                    only_events_in=event_groups,
-                    render_variation=render_variation_count_in_reservations,
-                    render_empty=None,
-                    show_empty_rows=False,
-                    table_class="count-config-table",
-                )
-            ).rows
-        ]
+            ],
+            render_variation=render_variation_count_in_reservations,
+            render_empty=None,
+            show_empty_rows=False,
+            table_class="count-config-table",
+        ).tables
 
         context["tables"] = tables
         context["event"] = current_event
@@ -141,7 +137,7 @@ class ReservationAdministrationView(LoginRequiredMixin, View):
             request,
             self.template_name,
             {
-                "reservations": Reservation.objects.filter(event=event),
+                "reservations": Reservation.objects.filter(event=event).with_prices(),
                 "state_buttons": self.state_buttons,
                 "event": event,
             },
@@ -164,7 +160,9 @@ class ReservationAdministrationView(LoginRequiredMixin, View):
 
 class ReservationPDFDownloadView(LoginRequiredMixin, View):
     def get(self, request, reservation_id):
-        reservation = get_object_or_404(Reservation, id=reservation_id)
+        reservation = get_object_or_404(
+            Reservation.objects.select_related("event").with_prices(), id=reservation_id
+        )
         filename = "c3foc-reservation_{number:02d}-{team_name}_{timestamp}.pdf".format(
             number=reservation.id,
             team_name=slugify(reservation.team_name),
@@ -180,7 +178,9 @@ class ReservationPDFDownloadView(LoginRequiredMixin, View):
 
 class ReservationCSVDownloadView(LoginRequiredMixin, View):
     def get(self, request, reservation_id):
-        reservation = get_object_or_404(Reservation, id=reservation_id)
+        reservation = get_object_or_404(
+            Reservation.objects.select_related("event").with_prices(), id=reservation_id
+        )
         filename = "c3foc-reservation_{number:02d}-{team_name}_{timestamp}.csv".format(
             number=reservation.id,
             team_name=slugify(reservation.team_name),
@@ -194,6 +194,21 @@ class ReservationCSVDownloadView(LoginRequiredMixin, View):
         return response
 
 
+class EventReservationsCSVDownloadView(LoginRequiredMixin, View):
+    def get(self, request, event_id):
+        event = get_object_or_404(Event, id=event_id)
+        filename = "c3foc-reservations-{event}_{timestamp}.csv".format(
+            event=slugify(event.name),
+            timestamp=timezone.now().strftime("%y-%m-%d_%H%M%S"),
+        )
+
+        response = StreamingHttpResponse(
+            iterate_in_thread(stream_event_reservations_csv(event)), content_type="text/csv"
+        )
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
 class ReservationPackedActionForm(forms.Form):
     BEHAVIOUR_CHOICES = [
         ("behaviour__set_packed", "Only set reservation to packed"),
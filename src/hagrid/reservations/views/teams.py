@@ -1,21 +1,25 @@
 from django import forms
 from django.contrib import messages
 from django.db import transaction
-from django.db.models import Sum
 from django.db.transaction import atomic
 from django.shortcuts import get_object_or_404, redirect, render
-from django.template.loader import render_to_string
 from django.utils.crypto import get_random_string
 from django.views import View
 from django.views.generic.base import TemplateView
 from django.views.generic.edit import FormView
 
 from hagrid.operations.models import Event
-from hagrid.products.models import Product, StoreSettings
-from hagrid.products.tables import ProductTable
+from hagrid.products.models import DesignVariation, Product, StoreSettings
+from hagrid.products.tables import ProductTableSet
 from hagrid.products.views.dashboard import get_current_open_status
 from hagrid.reservations import emails
-from hagrid.reservations.models import Reservation, ReservationPart, ReservationPosition
+from hagrid.reservations.models import (
+    CapacityExceeded,
+    Reservation,
+    ReservationPart,
+    ReservationPosition,
+    reserve_amounts,
+)
 
 
 def require_reservation_state(required_state, superuser_bypass=False):
@@ -64,7 +68,7 @@ class ReservationDetailView(TemplateView):
         )
 
     def get(self, request, secret):
-        reservation = get_object_or_404(Reservation, secret=secret)
+        reservation = get_object_or_404(Reservation.objects.with_prices(), secret=secret)
         return render(
             request,
             self.template_name,
@@ -150,15 +154,6 @@ class ReservationPartCreateView(View):
         # return redirect('reservationdetail', secret=secret)
 
 
-def amount_reserved(variation):
-    return (
-        ReservationPosition.objects.filter(variation=variation).aggregate(reserved=Sum("amount"))[
-            "reserved"
-        ]
-        or 0
-    )
-
-
 class ReservationPositionForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         disable_amount = kwargs.pop("disable_amount", False)
@@ -166,7 +161,7 @@ class ReservationPositionForm(forms.ModelForm):
         self.fields["variation"].widget = forms.NumberInput()
         variation = self.initial["variation"]
         old_amount = self.initial["amount"]
-        self.max_amount = max(0, variation.amount_initial - amount_reserved(variation) + old_amount)
+        self.max_amount = max(0, variation.amount_initial - variation.amount_reserved + old_amount)
         self.fields["amount"].widget.attrs.update({
             "style": "width: 7ch;",
             "class": "variationcounthighlight",
@@ -182,7 +177,7 @@ class ReservationPositionForm(forms.ModelForm):
         variation = cleaned_data["variation"]
         old_amount = self.initial["amount"]
         new_amount = max(0, cleaned_data.get("amount", 0))
-        max_amount = max(0, variation.amount_initial - amount_reserved(variation) + old_amount)
+        max_amount = max(0, variation.amount_initial - variation.amount_reserved + old_amount)
         if variation and new_amount and new_amount > max_amount:
             msg = (
                 "No {variation} available."
@@ -214,7 +209,7 @@ class ReservationPartDetailView(View):
             request, reservation_part
         )
         part_form = ReservationPartTitleForm(request.POST, instance=reservation_part)
-        if not part_form.is_valid() and all(f.is_valid() for f in variation_forms):
+        if not (part_form.is_valid() and all(f.is_valid() for f in variation_forms)):
             return render(
                 request,
                 "reservationpartdetail.html",
@@ -224,19 +219,34 @@ class ReservationPartDetailView(View):
                 },
             )
 
-        part_form.save()
-        for form in variation_forms:
-            if form.cleaned_data["amount"]:
-                position, created = ReservationPosition.objects.get_or_create(
-                    part=reservation_part,
-                    variation=form.cleaned_data["variation"],
+        try:
+            with transaction.atomic():
+                part_form.save()
+                self.save_positions(
+                    reservation_part,
+                    {
+                        form.cleaned_data["variation"].id: form.cleaned_data["amount"]
+                        for form in variation_forms
+                    },
                 )
-                position.amount = form.cleaned_data["amount"]
-                position.save()
-            else:
-                ReservationPosition.objects.filter(
-                    part=reservation_part, variation=form.cleaned_data["variation"]
-                ).delete()
+        except CapacityExceeded:
+            # someone else reserved in the meantime, show the forms again with
+            # what is left now
+            messages.add_message(
+                self.request,
+                messages.ERROR,
+                "Some items were reserved by someone else in the meantime. "
+                "Please check your amounts and save again.",
+            )
+            variation_tables, _ = self.get_variation_tables_and_forms(request, reservation_part)
+            return render(
+                request,
+                "reservationpartdetail.html",
+                {
+                    "variation_tables": variation_tables,
+                    "part_form": part_form,
+                },
+            )
         messages.add_message(
             self.request,
             messages.SUCCESS,
@@ -244,6 +254,40 @@ class ReservationPartDetailView(View):
         )
         return redirect("reservationdetail", secret=secret)
 
+    def save_positions(self, part, amounts):
+        """
+        Write the amounts (variation id -> amount) of the part, touching only
+        the positions that actually change. Raises CapacityExceeded if more
+        is reserved than is left.
+        """
+        positions = {
+            position.variation_id: position
+            for position in ReservationPosition.objects.filter(part=part)
+        }
+        created, updated, deleted = [], [], []
+        deltas = {}
+        for variation_id, amount in amounts.items():
+            position = positions.get(variation_id)
+            if not amount:
+                if position is not None:
+                    deleted.append(position.id)
+            elif position is None:
+                created.append(
+                    ReservationPosition(part=part, variation_id=variation_id, amount=amount)
+                )
+                deltas[variation_id] = amount
+            elif position.amount != amount:
+                deltas[variation_id] = amount - position.amount
+                position.amount = amount
+                updated.append(position)
+
+        # deleted positions are released by their post_delete signal
+        reserve_amounts(deltas)
+        ReservationPosition.objects.bulk_create(created)
+        ReservationPosition.objects.bulk_update(updated, ["amount"])
+        if deleted:
+            ReservationPosition.objects.filter(id__in=deleted).delete()
+
     @require_reservation_state(Reservation.STATE_EDITABLE, superuser_bypass=True)
     def get(self, request, secret, part_id):
         reservation_part = get_object_or_404(ReservationPart, id=part_id)
@@ -265,24 +309,23 @@ class ReservationPartDetailView(View):
     def get_variation_tables_and_forms(self, request, part):
         forms = []
 
-        part_positions = ReservationPosition.objects.filter(part=part)
-
-        def render_form(form):
-            return render_to_string(
-                "variation_picker_box.html", context={"form": form}, request=request
+        open_status = get_current_open_status()
+        reservable_events = set(open_status.allow_reservations_from.all())
+        reservable_design_variation_ids = set(
+            DesignVariation.objects.filter(design__event__in=reservable_events).values_list(
+                "id", flat=True
             )
+        )
+        part_amounts = dict(
+            ReservationPosition.objects.filter(part=part).values_list("variation_id", "amount")
+        )
 
         def render_variation_form(variation):
             prefix = f"{variation.id}"
-            disabled = (
-                variation.design_variation.design.event
-                not in get_current_open_status().allow_reservations_from.all()
-            )
-            try:
-                amount = part_positions.get(variation=variation).amount
-                disabled = disabled and amount == 0
-            except ReservationPosition.DoesNotExist:
-                amount = 0
+            amount = part_amounts.get(variation.id, 0)
+            # variations of events that are not offered can only be removed
+            disabled = variation.design_variation_id not in reservable_design_variation_ids
+            disabled = disabled and amount == 0
             if request.POST:
                 form = ReservationPositionForm(
                     request.POST,
@@ -306,33 +349,23 @@ class ReservationPartDetailView(View):
                     },
                 )
             forms.append(form)
-            return render_form(form)
+            return {"form": form}
 
         products = Product.objects.all()
-        open_status = get_current_open_status()
-        reservable_events = set(open_status.allow_reservations_from.all())
         current_event = (
             open_status.event if open_status else Event.objects.order_by("-day_1").first()
         )
-        tables = [
-            table
-            for event_groups, label in [
+        tables = ProductTableSet(
+            products,
+            [
                 (reservable_events & {current_event}, current_event.name),
                 (reservable_events - {current_event}, "old"),
-            ]
-            for product in products
-            if (
-                table := ProductTable(
-                    title=f"{label} {product.name}",
-                    product=product,
-                    only_events_in=event_groups,
-                    render_variation=render_variation_form,
-                    render_empty=None,
-                    show_empty_rows=False,
-                    table_class="count-config-table",
-                )
-            ).rows
-        ]
+            ],
+            render_variation=render_variation_form,
+            show_empty_rows=False,
+            table_class="count-config-table",
+            cell_template="variation_picker_box.html",
+        ).tables
         return tables, forms
 
 
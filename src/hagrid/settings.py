@@ -270,6 +270,12 @@ if not DEBUG and env.bool("EVENTSTREAM_USE_REDIS", True):
         "db": eventstream_redis_url.path,
     }
 
+# availability changes are pushed to dashboards at most once per window (in seconds)
+AVAILABILITY_DISPLAY_FLUSH_WINDOW = env.float("AVAILABILITY_DISPLAY_FLUSH_WINDOW", 0.25)
+
+# rendered QR codes are additionally cached in this directory, if set
+QR_CODE_CACHE_DIR = env.str("QR_CODE_CACHE_DIR", None)
+
 SECURE_CSP = {
     "default-src": [CSP.SELF],
     "script-src": [CSP.SELF, CSP.NONCE],
@@ -11,3 +11,37 @@ window.addEventListener('pageshow', (e) => {
     }
   }
 })
+
+// Apply the availability changes pushed to the dashboard. The server merges
+// all changes of a short time window into one {variationId: availability}
+// message, see AvailabilityDisplayPublisher.
+const AVAILABILITY_CLASSES = {
+  available: 'green',
+  'few available': 'yellow',
+  'sold out': 'red'
+}
+
+function applyAvailabilityChanges (e) {
+  for (const [variationId, availability] of Object.entries(JSON.parse(e.data))) {
+    const item = document.getElementById(`variation-tag-${variationId}`)
+    if (!item) {
+      continue
+    }
+    const oldTag = item.firstElementChild
+    const tag = document.createElement(availability === 'sold out' ? 'del' : 'span')
+    tag.className = oldTag.className
+    tag.classList.remove('gray', ...Object.values(AVAILABILITY_CLASSES))
+    tag.classList.add(AVAILABILITY_CLASSES[availability] || 'gray')
+    tag.append(...oldTag.childNodes)
+    tag.querySelector('.visually-hidden').textContent = availability
+    oldTag.replaceWith(tag)
+    item.title = `${item.title.slice(0, item.title.lastIndexOf(' is '))} is ${availability}`
+  }
+}
+
+document.addEventListener('htmx:sseOpen', (e) => {
+  if (e.target.id === 'availability-sections') {
+    // adding the same listener twice is a no-op, so reconnects are fine
+    e.detail.source.addEventListener('availability-changes', applyAvailabilityChanges)
+  }
+})
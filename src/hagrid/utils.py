@@ -1,9 +1,36 @@
 import os
 import string
 
+from asgiref.sync import sync_to_async
 from django.utils.crypto import get_random_string
 
 
+class Echo:
+    """
+    A file-like object for csv.writer that returns the written lines
+    instead of storing them, to stream csv files.
+    """
+
+    def write(self, value):
+        return value
+
+
+async def iterate_in_thread(iterator):
+    """
+    Yield the items of a sync iterator, e.g. a generator reading the
+    database, fetching each one with sync_to_async. Under ASGI, Django reads
+    all of a sync StreamingHttpResponse iterator before sending anything, an
+    async one is sent item by item.
+    """
+    done = object()
+    try:
+        while (item := await sync_to_async(next)(iterator, done)) is not done:
+            yield item
+    finally:
+        if close := getattr(iterator, "close", None):
+            await sync_to_async(close)()
+
+
 def django_secret_from_file(path: str):
     if os.path.exists(path):
         with open(path, "r", encoding="utf8") as f: